@@ -1,14 +1,65 @@
+import math
+
 import streamlit as st
-from pages.utils.table import get_table
+from pages.utils.pagination import PAGE_SIZE, SORT_KEYS, count_rows, get_page, next_cursor
+from pages.utils.queries import get_distinct, get_years
+from pages.utils.table import TABLE_COLUMNS
+
+sort_labels = {
+    "ano": "Ano e mês",
+    "valor_documento": "Valor do documento",
+    "nome_deputado": "Nome do deputado",
+    "tipo_despesa": "Tipo de despesa",
+}
+
+# ----------------------------
+with st.sidebar:
+    st.markdown("### Filtros")
+    anos = st.multiselect("Anos", get_years())
+    partidos = st.multiselect("Partidos", get_distinct("sigla_partido"))
+    ufs = st.multiselect("Estados (UF)", get_distinct("sigla_uf"))
+    tipos = st.multiselect("Tipos de despesa", get_distinct("tipo_despesa"))
+    search = st.text_input("Buscar deputado ou fornecedor")
+
+    st.markdown("### Ordenação")
+    sort = st.selectbox("Ordenar por", list(SORT_KEYS), format_func=sort_labels.get)
+    descending = st.toggle("Decrescente", value=sort == "valor_documento")
+
+filters = (
+    ("ano", tuple(anos)),
+    ("sigla_partido", tuple(partidos)),
+    ("sigla_uf", tuple(ufs)),
+    ("tipo_despesa", tuple(tipos)),
+)
+
+# Only the cursors of the pages visited so far are kept per session, the rows themselves are shared
+query_key = (filters, search, sort, descending)
+if st.session_state.get("table_query") != query_key:
+    st.session_state.table_query = query_key
+    st.session_state.table_cursors = [None]
+cursors = st.session_state.table_cursors
+
+df = get_page(filters=filters, search=search, sort=sort, descending=descending, after=cursors[-1])
+cursor = next_cursor(df, sort)
+
+st.markdown("# Tabela")
+st.dataframe(df, hide_index=True, column_order=list(TABLE_COLUMNS), height=(PAGE_SIZE + 1) * 35 + 3)
+
+col1, col2, col3 = st.columns([1, 2, 1])
 
-if "full_df" not in st.session_state:
-    st.session_state.full_df = get_table()
-full_df = st.session_state.full_df
+with col1:
+    if st.button("Anterior", disabled=len(cursors) == 1):
+        cursors.pop()
+        st.rerun()
 
-num_rows = 100
-page_num = st.slider("Page number", 1, (len(full_df) // num_rows) + 1)
+with col2:
+    if search:
+        st.markdown(f"Página {len(cursors)}")
+    else:
+        pages = max(math.ceil(count_rows(filters) / PAGE_SIZE), 1)
+        st.markdown(f"Página {len(cursors)} de {pages}")
 
-start_index = (page_num - 1) * num_rows
-end_index = start_index + num_rows
-calculated_height = (num_rows + 1) * 35 + 3
-st.dataframe(full_df[start_index:end_index], height=3550)
+with col3:
+    if st.button("Próxima", disabled=cursor is None):
+        cursors.append(cursor)
+        st.rerun()
@@ -1,13 +1,8 @@
 import streamlit as st
-from pages.utils.plots import create_bar_plot
-from pages.utils.table import get_table
+from pages.utils.plots import BarChart, create_bar_plots
+from pages.utils.queries import run_plan
 
 st.markdown("# Gráficos Dinâmicos")
-# ----------------------------
-if "full_df" not in st.session_state:
-    st.session_state.full_df = get_table()
-full_df = st.session_state.full_df
-
 # ----------------------------
 
 y_columns = [
@@ -25,6 +20,9 @@ x: str = st.selectbox("Selecione a coluna que será agregada:", ["valor_document
 operation = st.selectbox(
     "Selecione a função de agregação:", ["soma", "quantidade", "media", "mediana", "valor máximo", "valor mínimo"]
 )
+approximate = st.toggle(
+    "Modo aproximado", help="Combina resultados calculados por ano; medianas são estimadas com erro de até 1%."
+)
 
 match operation:
     case "soma":
@@ -48,12 +46,12 @@ match operation:
     case _:
         agg_function = "sum"
 
-create_bar_plot(
-    df=full_df,
-    x=x,
+chart = BarChart(
     y=y,
+    x=x,
     x_label=f"{x} ({operation})",
     y_label=y,
     title=f"{y} X {x} ({operation})",
     agg_function=agg_function,
 )
+create_bar_plots([chart], run_plan([chart.request], approximate=approximate))
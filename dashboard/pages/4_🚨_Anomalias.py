@@ -0,0 +1,17 @@
+import streamlit as st
+from pages.utils.queries import get_anomalies, get_years
+
+# ----------------------------
+with st.sidebar:
+    st.markdown("### Filtros")
+    anos = st.multiselect("Selecione um ou mais anos", get_years())
+    limit = st.slider("Quantidade de despesas", 10, 500, 100, step=10)
+
+st.markdown("# Despesas atípicas")
+st.markdown("Despesas sinalizadas pelo modelo de detecção de anomalias, das mais atípicas para as menos atípicas.")
+
+df = get_anomalies(anos or None, limit)
+if df.empty:
+    st.info("Nenhuma despesa sinalizada. Execute a ingestão com `--score-anomalies` para calcular as pontuações.")
+else:
+    st.dataframe(df, hide_index=True)
@@ -0,0 +1,102 @@
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from functools import wraps
+from typing import Any
+
+import pandas as pd
+import streamlit as st
+from pages.utils.db import run_query
+
+CACHE_TTL = int(os.environ.get("DASHBOARD_CACHE_TTL", "3600"))
+CACHE_MAX_BYTES = int(os.environ.get("DASHBOARD_CACHE_MAX_BYTES", str(2 * 1024**3)))
+MARKER_TTL = 30
+
+
+def _size(value: Any) -> int:
+    if isinstance(value, pd.DataFrame | pd.Series):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, tuple | list):
+        return sum(_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class SharedCache:
+    """Process-wide LRU shared by every session, bounded by entry age and total size in memory."""
+
+    def __init__(self, ttl: float = CACHE_TTL, max_bytes: int = CACHE_MAX_BYTES) -> None:
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[tuple, tuple[float, int, Any]] = OrderedDict()
+        self.total_bytes = 0
+        self.marker: str | None = None
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple) -> tuple[bool, Any]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False, None
+            stored_at, size, value = entry
+            if time.time() - stored_at > self.ttl:
+                del self.entries[key]
+                self.total_bytes -= size
+                return False, None
+            self.entries.move_to_end(key)
+            return True, value
+
+    def set(self, key: tuple, value: Any) -> None:
+        size = _size(value)
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (time.time(), size, value)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+
+    def invalidate(self, marker: str | None) -> None:
+        with self.lock:
+            if marker != self.marker:
+                self.entries.clear()
+                self.total_bytes = 0
+                self.marker = marker
+
+
+@st.cache_resource
+def get_shared_cache() -> SharedCache:
+    return SharedCache()
+
+
+@st.cache_data(ttl=MARKER_TTL, show_spinner=False)
+def get_last_ingested() -> str | None:
+    df = run_query("SELECT versao FROM ultima_carga WHERE id = 1;")
+    return None if df.empty else str(df.loc[0, "versao"])
+
+
+# Results are shared between sessions as is, so callers must treat them as read-only
+def shared_cache(function: Callable) -> Callable:
+    @wraps(function)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        cache = get_shared_cache()
+        cache.invalidate(get_last_ingested())
+
+        key = (
+            function.__module__,
+            function.__qualname__,
+            tuple(tuple(arg) if isinstance(arg, list) else arg for arg in args),
+            tuple(sorted((name, tuple(value) if isinstance(value, list) else value) for name, value in kwargs.items())),
+        )
+        found, value = cache.get(key)
+        if not found:
+            value = function(*args, **kwargs)
+            cache.set(key, value)
+        return value
+
+    return wrapper
@@ -0,0 +1,45 @@
+import os
+import sys
+from pathlib import Path
+
+import duckdb
+import pandas as pd
+from dotenv import load_dotenv
+from sqlalchemy import Engine
+from sqlalchemy.exc import SQLAlchemyError
+
+# The dashboard is started as a script, so the repository root has to be importable to share the ingestion code
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+
+from data_ingestion.services.duckdb_service import DUCKDB_PATH, query_frame
+from data_ingestion.services.engine_service import FETCH_SIZE, env_url, fetch_frame, get_engine
+from data_ingestion.services.log_service import logger
+
+_ = load_dotenv()
+
+# "mysql" queries the database server, "duckdb" the embedded copy written by the ingestion with --duckdb
+DASHBOARD_ENGINE = os.environ.get("DASHBOARD_ENGINE", "mysql")
+DASHBOARD_DUCKDB_PATH = os.environ.get("DASHBOARD_DUCKDB_PATH", DUCKDB_PATH)
+
+
+def get_dashboard_engine() -> Engine:
+    return get_engine(env_url())
+
+
+def run_query(query: str, params: tuple | list | None = None) -> pd.DataFrame:
+    return run_typed_query(query, params)
+
+
+def run_typed_query(
+    query: str,
+    params: tuple | list | None = None,
+    dtypes: dict[str, str] | None = None,
+    chunk_size: int = FETCH_SIZE,
+) -> pd.DataFrame:
+    try:
+        if DASHBOARD_ENGINE == "duckdb":
+            return query_frame(DASHBOARD_DUCKDB_PATH, query, params, dtypes)
+        return fetch_frame(get_dashboard_engine(), query, params, dtypes, chunk_size)
+    except (SQLAlchemyError, duckdb.Error, OSError) as err:
+        logger.error(f"Error: {err}")
+        return pd.DataFrame()
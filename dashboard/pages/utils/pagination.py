@@ -0,0 +1,214 @@
+import operator
+import re
+from functools import reduce
+from pathlib import Path
+from typing import Any
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from pages.utils.cache import shared_cache
+from pages.utils.db import DASHBOARD_ENGINE, run_query, run_typed_query
+from pages.utils.table import SNAPSHOT_DIR, TABLE_COLUMNS, TABLE_DTYPES, TABLE_SOURCE
+
+PAGE_SIZE = 100
+
+# Each sort option is backed by an index on despesas, the row id breaks ties so the keyset is unique
+SORT_KEYS = {
+    "ano": ["ano", "mes"],
+    "valor_documento": ["valor_documento"],
+    "nome_deputado": ["nome_deputado"],
+    "tipo_despesa": ["tipo_despesa"],
+}
+FILTER_COLUMNS = ["ano", "sigla_partido", "sigla_uf", "tipo_despesa"]
+SEARCH_COLUMNS = ["nome_deputado", "nome_fornecedor"]
+# InnoDB's innodb_ft_min_token_size, shorter words are not in the full-text index
+FULLTEXT_MIN_TOKEN_SIZE = 3
+PAGE_DTYPES = {"id": "int64"} | {column: dtype for column, dtype in TABLE_DTYPES.items() if dtype != "category"}
+
+Filters = tuple[tuple[str, tuple], ...]
+Cursor = tuple[Any, ...]
+
+
+def _python_value(value: Any) -> Any:
+    if pd.isna(value):
+        return None
+    return value.item() if hasattr(value, "item") else value
+
+
+def next_cursor(df: pd.DataFrame, sort: str, page_size: int = PAGE_SIZE) -> Cursor | None:
+    if len(df) < page_size:
+        return None
+    last_row = df.iloc[-1]
+    return tuple(_python_value(last_row[column]) for column in [*SORT_KEYS[sort], "id"])
+
+
+# (a, b, id) > (x, y, z) spelled out, so each branch can be served by the sort index
+def _keyset_terms(columns: list[str], after: Cursor, descending: bool) -> list[tuple[list[tuple[str, str]], list]]:
+    comparison = "<" if descending else ">"
+    terms = []
+    for position, column in enumerate(columns):
+        comparisons = [(previous, "=") for previous in columns[:position]] + [(column, comparison)]
+        terms.append((comparisons, list(after[: position + 1])))
+    return terms
+
+
+# NULL sort values, such as a valor_documento left empty by the source, stay where each engine sorts them: MySQL
+# puts NULL below every value, DuckDB and Arrow put NULLs last in both directions
+def _nulls_after(descending: bool) -> bool:
+    return descending or DASHBOARD_ENGINE == "duckdb"
+
+
+def _sql_comparison(expression: str, sign: str, value: Any, nulls_after: bool) -> tuple[str, list] | None:
+    if value is None:
+        if sign == "=":
+            return f"{expression} IS NULL", []
+        # Nothing follows a NULL when NULLs come last, every value does when they come first
+        return None if nulls_after else (f"{expression} IS NOT NULL", [])
+    if sign != "=" and nulls_after:
+        return f"({expression} {sign} %s OR {expression} IS NULL)", [value]
+    return f"{expression} {sign} %s", [value]
+
+
+# Words shorter than the index minimum never match, requiring them would fail the whole search
+def _fulltext_query(words: list[str]) -> str:
+    return " ".join(f"+{word}*" if len(word) >= FULLTEXT_MIN_TOKEN_SIZE else f"{word}*" for word in words)
+
+
+def _database_page(
+    filters: Filters, search: str, sort: str, descending: bool, after: Cursor | None, page_size: int
+) -> pd.DataFrame:
+    expressions = {"id": "despesas.id"} | TABLE_COLUMNS
+    conditions: list[str] = []
+    params: list[Any] = []
+
+    for column, values in filters:
+        conditions.append(f"{expressions[column]} IN ({', '.join(['%s'] * len(values))})")
+        params.extend(values)
+
+    words = re.findall(r"\w+", search)
+    if words and (DASHBOARD_ENGINE == "duckdb" or max(map(len, words)) < FULLTEXT_MIN_TOKEN_SIZE):
+        # DuckDB has no full-text index and MySQL's has no words this short, so the names are scanned for the text
+        # instead, as in the snapshot
+        conditions.append(
+            f"({' OR '.join(f'INSTR(LOWER({TABLE_COLUMNS[column]}), %s) > 0' for column in SEARCH_COLUMNS)})"
+        )
+        params.extend([search.lower()] * len(SEARCH_COLUMNS))
+    elif words:
+        query = _fulltext_query(words)
+        conditions.append(
+            "(despesas.deputado_id IN (SELECT id FROM deputados WHERE MATCH(nome) AGAINST (%s IN BOOLEAN MODE))"
+            " OR despesas.fornecedor_id IN"
+            " (SELECT id FROM fornecedores WHERE MATCH(nome_fornecedor) AGAINST (%s IN BOOLEAN MODE)))"
+        )
+        params.extend([query, query])
+
+    sort_columns = [*SORT_KEYS[sort], "id"]
+    if after is not None:
+        branches = []
+        for comparisons, values in _keyset_terms(sort_columns, after, descending):
+            terms = [
+                _sql_comparison(expressions[column], sign, value, _nulls_after(descending))
+                for (column, sign), value in zip(comparisons, values, strict=True)
+            ]
+            if any(term is None for term in terms):
+                continue
+            branches.append(" AND ".join(term for term, _ in terms))
+            params.extend(value for _, term_params in terms for value in term_params)
+        conditions.append(f"({' OR '.join(f'({branch})' for branch in branches)})")
+
+    direction = "DESC" if descending else "ASC"
+    query = f"""
+        SELECT
+            {", ".join(f"{expression} AS {column}" for column, expression in expressions.items())}
+        FROM
+            despesas
+        LEFT JOIN
+            deputados ON despesas.deputado_id = deputados.id
+        LEFT JOIN
+            fornecedores ON despesas.fornecedor_id = fornecedores.id
+        {"WHERE " + " AND ".join(conditions) if conditions else ""}
+        ORDER BY {", ".join(f"{expressions[column]} {direction}" for column in sort_columns)}
+        LIMIT %s;
+    """
+
+    return run_typed_query(query, [*params, page_size], PAGE_DTYPES)
+
+
+# Same rules as _sql_comparison, with the NULLs Arrow sorts last
+def _compare(column: str, sign: str, value: Any) -> ds.Expression | None:
+    if value is None:
+        return ds.field(column).is_null() if sign == "=" else None
+    match sign:
+        case "<":
+            return (ds.field(column) < value) | ds.field(column).is_null()
+        case ">":
+            return (ds.field(column) > value) | ds.field(column).is_null()
+        case _:
+            return ds.field(column) == value
+
+
+# The snapshot has no indexes, but filters are pushed into the Parquet scan and only the top rows are sorted
+def _snapshot_page(
+    filters: Filters, search: str, sort: str, descending: bool, after: Cursor | None, page_size: int
+) -> pd.DataFrame:
+    dataset = ds.dataset(
+        SNAPSHOT_DIR, format="parquet", partitioning=ds.partitioning(pa.schema([("ano", pa.int16())]), flavor="hive")
+    )
+
+    conditions = [ds.field(column).isin(values) for column, values in filters]
+    if search:
+        matches = [pc.match_substring(ds.field(column), search, ignore_case=True) for column in SEARCH_COLUMNS]
+        conditions.append(reduce(operator.or_, matches))
+
+    sort_columns = [*SORT_KEYS[sort], "id"]
+    if after is not None:
+        branches = []
+        for comparisons, values in _keyset_terms(sort_columns, after, descending):
+            terms = [_compare(*comparison, value) for comparison, value in zip(comparisons, values, strict=True)]
+            if all(term is not None for term in terms):
+                branches.append(reduce(operator.and_, terms))
+        conditions.append(reduce(operator.or_, branches))
+
+    expression = reduce(operator.and_, conditions) if conditions else None
+    table = dataset.to_table(columns=["id", *TABLE_COLUMNS], filter=expression)
+    sort_keys = [(column, "descending" if descending else "ascending") for column in sort_columns]
+    page = table.take(pc.select_k_unstable(table, page_size, sort_keys)).sort_by(sort_keys)
+    return page.to_pandas().astype(PAGE_DTYPES)
+
+
+@shared_cache
+def get_page(
+    filters: Filters = (),
+    search: str = "",
+    sort: str = "ano",
+    descending: bool = False,
+    after: Cursor | None = None,
+    page_size: int = PAGE_SIZE,
+    source: str = TABLE_SOURCE,
+) -> pd.DataFrame:
+    if sort not in SORT_KEYS:
+        msg = f"Unsupported sort column {sort}"
+        raise ValueError(msg)
+    filters = tuple((column, values) for column, values in filters if column in FILTER_COLUMNS and values)
+
+    if source == "parquet" and Path(SNAPSHOT_DIR).exists():
+        return _snapshot_page(filters, search.strip(), sort, descending, after, page_size)
+
+    return _database_page(filters, search.strip(), sort, descending, after, page_size)
+
+
+# Row counts come from the rollup table, which has every filter column, so they stay cheap on large tables
+@shared_cache
+def count_rows(filters: Filters = ()) -> int:
+    conditions = []
+    params: list[Any] = []
+    for column, values in filters:
+        if column in FILTER_COLUMNS and values:
+            conditions.append(f"{column} IN ({', '.join(['%s'] * len(values))})")
+            params.extend(values)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    df = run_query(f"SELECT COALESCE(SUM(linhas), 0) AS linhas FROM despesas_agregadas {where};", params)
+    return 0 if df.empty else int(df.loc[0, "linhas"])
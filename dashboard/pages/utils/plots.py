@@ -1,6 +1,11 @@
+from dataclasses import dataclass
+
 import altair as alt
 import pandas as pd
 import streamlit as st
+from pages.utils.queries import AGG_FUNCTIONS
+
+BAR_LIMIT = 100
 
 
 def create_bar_plot(
@@ -13,41 +18,58 @@ def create_bar_plot(
     limit: int | None = None,
     agg_function: str = "sum",
 ) -> None:
-    df[y] = df[y].astype(str)
+    # The frame is shared between sessions, so only the aggregated result is built here
+    grouped = df.groupby(y, observed=True, sort=False)[x]
+    grouped_df = grouped.agg(agg_function if agg_function in AGG_FUNCTIONS else "sum").reset_index()
+    grouped_df[y] = grouped_df[y].astype(str)
 
-    match agg_function:
-        case "sum":
-            grouped_df = df[[y, x]].groupby(y).sum()
+    if limit is None and len(grouped_df) > BAR_LIMIT:
+        st.warning(f"A quantidade de resultados é de {len(grouped_df)}, limitando aos {BAR_LIMIT} maiores resultados.")
+        limit = BAR_LIMIT
 
-        case "count":
-            grouped_df = df[[y, x]].groupby(y).count()
+    if limit:
+        grouped_df = grouped_df.nlargest(limit, x)
 
-        case "mean":
-            grouped_df = df[[y, x]].groupby(y).mean()
+    draw_bar_plot(grouped_df, x, y, x_label, y_label, title)
 
-        case "median":
-            grouped_df = df[[y, x]].groupby(y).median()
 
-        case "max":
-            grouped_df = df[[y, x]].groupby(y).max()
+@dataclass(frozen=True)
+class BarChart:
+    y: str
+    x_label: str
+    y_label: str
+    title: str
+    limit: int | None = None
+    agg_function: str = "sum"
+    x: str = "valor_documento"
 
-        case "min":
-            grouped_df = df[[y, x]].groupby(y).min()
-        case _:
-            grouped_df = df[[y, x]].groupby(y).sum()
+    @property
+    def request(self) -> tuple[tuple[str, ...], str]:
+        return (self.y,), self.agg_function
 
-    grouped_df = grouped_df.reset_index()
 
-    bar_limit = 100
-    if limit is None and len(grouped_df) > bar_limit:
-        st.warning(f"A quantidade de resultados é de {len(grouped_df)}, limitando aos {bar_limit} maiores resultados.")
-        limit = bar_limit
+def create_aggregated_bar_plot(grouped_df: pd.DataFrame, chart: BarChart) -> None:
+    agg_function = chart.agg_function if chart.agg_function in AGG_FUNCTIONS else "sum"
+    limit = chart.limit
+
+    if limit is None and len(grouped_df) > BAR_LIMIT:
+        st.warning(f"A quantidade de resultados é de {len(grouped_df)}, limitando aos {BAR_LIMIT} maiores resultados.")
+        limit = BAR_LIMIT
+
+    top_df = grouped_df.nlargest(limit, agg_function) if limit else grouped_df
+    plot_df = pd.DataFrame({chart.y: top_df[chart.y].astype(str), chart.x: top_df[agg_function]})
+    draw_bar_plot(plot_df, chart.x, chart.y, chart.x_label, chart.y_label, chart.title)
+
+
+def create_bar_plots(charts: list[BarChart], results: dict[tuple[str, ...], pd.DataFrame]) -> None:
+    for chart in charts:
+        create_aggregated_bar_plot(results[chart.y,], chart)
 
-    if limit:
-        grouped_df = grouped_df.sort_values(by=x, ascending=False).iloc[:limit]
 
+def draw_bar_plot(grouped_df: pd.DataFrame, x: str, y: str, x_label: str, y_label: str, title: str) -> None:
     st.write(
-        alt.Chart(grouped_df)
+        alt
+        .Chart(grouped_df)
         .mark_bar()
         .encode(
             y=alt.Y(y, title=y_label, sort="-x"),
@@ -0,0 +1,250 @@
+import pandas as pd
+from pages.utils.cache import shared_cache
+from pages.utils.db import DASHBOARD_ENGINE, run_query
+from pages.utils.sketches import bucket_expression, merge_sketches, sketch_quantile
+
+# Group columns exposed to the charts, as read from the rollup table (a) and from the raw expenses (d)
+ROLLUP_COLUMNS = {
+    "tipo_despesa": "a.tipo_despesa",
+    "nome_deputado": "a.nome_deputado",
+    "ano": "a.ano",
+    "mes": "a.mes",
+    "sigla_partido": "a.sigla_partido",
+    "sigla_uf": "a.sigla_uf",
+    "nome_fornecedor": "f.nome_fornecedor",
+}
+DESPESAS_COLUMNS = {
+    "tipo_despesa": "d.tipo_despesa",
+    "nome_deputado": "d.nome_deputado",
+    "ano": "d.ano",
+    "mes": "d.mes",
+    "sigla_partido": "dep.sigla_partido",
+    "sigla_uf": "dep.sigla_uf",
+    "nome_fornecedor": "f.nome_fornecedor",
+}
+ROLLUP_AGGREGATIONS = {
+    "sum": "SUM(a.total)",
+    "count": "SUM(a.quantidade)",
+    "mean": "SUM(a.total) / SUM(a.quantidade)",
+    "max": "MAX(a.maximo)",
+    "min": "MIN(a.minimo)",
+}
+AGG_FUNCTIONS = [*ROLLUP_AGGREGATIONS, "median"]
+
+
+def _years_filter(column: str, anos: list[int] | None) -> tuple[str, list[int]]:
+    if anos is None:
+        return "", []
+    if not anos:
+        return "WHERE 1 = 0", []
+    return f"WHERE {column} IN ({', '.join(['%s'] * len(anos))})", list(anos)
+
+
+@shared_cache
+def get_years() -> list[int]:
+    df = run_query("SELECT DISTINCT ano FROM despesas_agregadas ORDER BY ano;")
+    return df["ano"].astype(int).tolist() if not df.empty else []
+
+
+@shared_cache
+def get_summary(anos: list[int] | None = None) -> dict:
+    where, params = _years_filter("ano", anos)
+    query = f"""
+        SELECT
+            COALESCE(SUM(total), 0) AS total,
+            COUNT(DISTINCT nome_deputado) AS deputados,
+            COUNT(DISTINCT sigla_partido) AS partidos
+        FROM despesas_agregadas
+        {where};
+    """
+    df = run_query(query, params)
+    if df.empty:
+        return {"total": 0.0, "deputados": 0, "partidos": 0}
+    return {
+        "total": float(df.loc[0, "total"]),
+        "deputados": int(df.loc[0, "deputados"]),
+        "partidos": int(df.loc[0, "partidos"]),
+    }
+
+
+# Every rollup aggregate comes out of the same scan, so they are always computed together
+@shared_cache
+def aggregate_by(keys: tuple[str, ...], anos: list[int] | None = None) -> pd.DataFrame:
+    where, params = _years_filter("a.ano", anos)
+    query = f"""
+        SELECT
+            {", ".join(f"{ROLLUP_COLUMNS[key]} AS {key}" for key in keys)},
+            {", ".join(f"{expression} AS {name}" for name, expression in ROLLUP_AGGREGATIONS.items())}
+        FROM despesas_agregadas a
+        LEFT JOIN fornecedores f ON a.fornecedor_id = f.id
+        {where}
+        GROUP BY {", ".join(keys)}
+        ORDER BY {", ".join(keys)};
+    """
+    df = run_query(query, params)
+    if df.empty:
+        return pd.DataFrame(columns=[*keys, *ROLLUP_AGGREGATIONS])
+    return df.astype(dict.fromkeys(ROLLUP_AGGREGATIONS, "float64"))
+
+
+# Medians can't be merged from partial aggregates, so they are computed on the raw rows inside the database
+@shared_cache
+def median_by(keys: tuple[str, ...], anos: list[int] | None = None) -> pd.DataFrame:
+    where, params = _years_filter("d.ano", anos)
+    groups = ", ".join(DESPESAS_COLUMNS[key] for key in keys)
+    # DuckDB has an exact MEDIAN aggregate, computed per group in parallel without sorting the whole table
+    if DASHBOARD_ENGINE == "duckdb":
+        query = f"""
+            SELECT
+                {", ".join(f"{DESPESAS_COLUMNS[key]} AS {key}" for key in keys)},
+                MEDIAN(d.valor_documento) AS median
+            FROM despesas d
+            LEFT JOIN deputados dep ON d.deputado_id = dep.id
+            LEFT JOIN fornecedores f ON d.fornecedor_id = f.id
+            {where}
+            GROUP BY {groups};
+        """
+    else:
+        query = f"""
+            SELECT {", ".join(keys)}, AVG(valor) AS median
+            FROM (
+                SELECT
+                    {", ".join(f"{DESPESAS_COLUMNS[key]} AS {key}" for key in keys)},
+                    d.valor_documento AS valor,
+                    ROW_NUMBER() OVER (PARTITION BY {groups} ORDER BY d.valor_documento) AS posicao,
+                    COUNT(*) OVER (PARTITION BY {groups}) AS n
+                FROM despesas d
+                LEFT JOIN deputados dep ON d.deputado_id = dep.id
+                LEFT JOIN fornecedores f ON d.fornecedor_id = f.id
+                {where}
+            ) t
+            WHERE posicao IN (FLOOR((n + 1) / 2), FLOOR((n + 2) / 2))
+            GROUP BY {", ".join(keys)};
+        """
+    df = run_query(query, params)
+    if df.empty:
+        return pd.DataFrame(columns=[*keys, "median"])
+    return df.astype({"median": "float64"})
+
+
+def plan_aggregations(requests: list[tuple[tuple[str, ...], str]]) -> dict[tuple[str, ...], set[str]]:
+    plan: dict[tuple[str, ...], set[str]] = {}
+    for keys, agg_function in requests:
+        if any(key not in ROLLUP_COLUMNS for key in keys):
+            msg = f"Unsupported grouping by {keys}"
+            raise ValueError(msg)
+        plan.setdefault(keys, set()).add(agg_function if agg_function in AGG_FUNCTIONS else "sum")
+    return plan
+
+
+# Exact partial aggregates of one year; sums, counts, minimums and maximums combine across years
+@shared_cache
+def aggregate_year(keys: tuple[str, ...], ano: int) -> pd.DataFrame:
+    query = f"""
+        SELECT
+            {", ".join(f"{ROLLUP_COLUMNS[key]} AS {key}" for key in keys)},
+            SUM(a.total) AS total,
+            SUM(a.quantidade) AS quantidade,
+            MIN(a.minimo) AS minimo,
+            MAX(a.maximo) AS maximo
+        FROM despesas_agregadas a
+        LEFT JOIN fornecedores f ON a.fornecedor_id = f.id
+        WHERE a.ano = %s
+        GROUP BY {", ".join(keys)};
+    """
+    df = run_query(query, [ano])
+    if df.empty:
+        return pd.DataFrame(columns=[*keys, "total", "quantidade", "minimo", "maximo"])
+    return df
+
+
+# Quantile sketch of one year, bucketed inside the database so only the bucket counts cross the wire
+@shared_cache
+def sketch_year(keys: tuple[str, ...], ano: int) -> pd.DataFrame:
+    sinal, bucket = bucket_expression("d.valor_documento")
+    query = f"""
+        SELECT
+            {", ".join(f"{DESPESAS_COLUMNS[key]} AS {key}" for key in keys)},
+            {sinal} AS sinal,
+            {bucket} AS bucket,
+            COUNT(*) AS quantidade
+        FROM despesas d
+        LEFT JOIN deputados dep ON d.deputado_id = dep.id
+        LEFT JOIN fornecedores f ON d.fornecedor_id = f.id
+        WHERE d.ano = %s AND d.valor_documento IS NOT NULL
+        GROUP BY {", ".join(keys)}, sinal, bucket;
+    """
+    df = run_query(query, [ano])
+    if df.empty:
+        return pd.DataFrame(columns=[*keys, "sinal", "bucket", "quantidade"])
+    return df
+
+
+def _combine_years(keys: tuple[str, ...], anos: list[int], agg_functions: set[str]) -> pd.DataFrame:
+    partials = [df for df in (aggregate_year(keys, ano) for ano in anos) if not df.empty]
+    if not partials:
+        return pd.DataFrame(columns=[*keys, *AGG_FUNCTIONS])
+
+    combined = (
+        pd
+        .concat(partials, ignore_index=True)
+        .groupby(list(keys), as_index=False)
+        .agg(sum=("total", "sum"), count=("quantidade", "sum"), min=("minimo", "min"), max=("maximo", "max"))
+    )
+    combined = combined.assign(mean=combined["sum"] / combined["count"])
+
+    if "median" in agg_functions:
+        sketch = merge_sketches([sketch_year(keys, ano) for ano in anos], list(keys))
+        combined = combined.merge(sketch_quantile(sketch, list(keys)), on=list(keys), how="left")
+    return combined.astype(dict.fromkeys([column for column in AGG_FUNCTIONS if column in combined], "float64"))
+
+
+# One query per distinct grouping, with every requested aggregation as a column of its result.
+# The approximate mode works year by year instead, so adding a year to the filter only fetches that year,
+# and medians come from merged quantile sketches rather than from a sort of the raw rows.
+def run_plan(
+    requests: list[tuple[tuple[str, ...], str]],
+    anos: list[int] | None = None,
+    approximate: bool = False,
+) -> dict[tuple[str, ...], pd.DataFrame]:
+    results = {}
+    for keys, agg_functions in plan_aggregations(requests).items():
+        if approximate:
+            results[keys] = _combine_years(keys, get_years() if anos is None else anos, agg_functions)
+            continue
+
+        df = aggregate_by(keys, anos)
+        if "median" in agg_functions:
+            df = df.merge(median_by(keys, anos), on=list(keys), how="left")
+        results[keys] = df
+    return results
+
+
+@shared_cache
+def get_distinct(column: str) -> list:
+    if column not in ROLLUP_COLUMNS or column == "nome_fornecedor":
+        msg = f"Unsupported column {column}"
+        raise ValueError(msg)
+    df = run_query(f"SELECT DISTINCT {column} FROM despesas_agregadas WHERE {column} IS NOT NULL ORDER BY {column};")
+    return [] if df.empty else df[column].tolist()
+
+
+# Most isolated expenses first, as scored by the ingestion's anomaly model; empty until it has run
+@shared_cache
+def get_anomalies(anos: list[int] | None = None, limit: int = 100) -> pd.DataFrame:
+    where, params = _years_filter("d.ano", anos)
+    where = f"{where} AND a.anomalia = 1" if where else "WHERE a.anomalia = 1"
+    query = f"""
+        SELECT
+            {", ".join(f"{expression} AS {column}" for column, expression in DESPESAS_COLUMNS.items())},
+            d.valor_documento AS valor_documento,
+            a.score AS score
+        FROM despesas_anomalias a
+        JOIN despesas d ON a.despesa_id = d.id
+        LEFT JOIN deputados dep ON d.deputado_id = dep.id
+        LEFT JOIN fornecedores f ON d.fornecedor_id = f.id
+        {where}
+        ORDER BY a.score
+        LIMIT %s;
+    """
+    return run_query(query, [*params, limit])
@@ -0,0 +1,49 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+# Quantiles read from a sketch are within this relative error of the exact value
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+
+
+# A sketch is a frame of (keys..., sinal, bucket, quantidade) rows: how many values of each group fell in each
+# logarithmic bucket. Values in bucket k lie in (GAMMA^(k-1), GAMMA^k], so sketches built per year can be merged
+# by adding their counts, and any quantile can be read back from the merged counts.
+def bucket_expression(column: str) -> tuple[str, str]:
+    sinal = f"SIGN({column})"
+    bucket = f"CASE WHEN {column} = 0 THEN 0 ELSE CEIL(LN(ABS({column})) / {LOG_GAMMA!r}) END"
+    return sinal, bucket
+
+
+def merge_sketches(sketches: list[pd.DataFrame], keys: list[str]) -> pd.DataFrame:
+    sketches = [sketch for sketch in sketches if not sketch.empty]
+    if not sketches:
+        return pd.DataFrame(columns=[*keys, "sinal", "bucket", "quantidade"])
+    merged = pd.concat(sketches, ignore_index=True)
+    return merged.groupby([*keys, "sinal", "bucket"], as_index=False, observed=True)["quantidade"].sum()
+
+
+def sketch_quantile(sketch: pd.DataFrame, keys: list[str], q: float = 0.5, name: str = "median") -> pd.DataFrame:
+    if sketch.empty:
+        return pd.DataFrame(columns=[*keys, name])
+
+    bucket = sketch["bucket"].to_numpy(dtype="float64")
+    representative = 2 * np.power(GAMMA, bucket) / (GAMMA + 1)
+    values = sketch.assign(valor=sketch["sinal"].to_numpy(dtype="float64") * representative)
+    values = values.sort_values([*keys, "valor"], ignore_index=True)
+
+    grouped = values.groupby(keys, observed=True)["quantidade"]
+    cumulative = grouped.cumsum()
+    rank = q * (grouped.transform("sum") - 1)
+
+    # Same interpolation as the exact quantile: the mean of the values around the fractional rank
+    bounds = []
+    for position in (np.floor(rank), np.ceil(rank)):
+        bound = values[cumulative > position].groupby(keys, as_index=False, observed=True).first()
+        bounds.append(bound[[*keys, "valor"]].set_index(keys)["valor"])
+    lower, upper = bounds
+    weight = (rank - np.floor(rank)).groupby([values[key] for key in keys], observed=True).first()
+    return (lower + (upper - lower) * weight).rename(name).reset_index()
@@ -1,61 +1,87 @@
 import os
+from pathlib import Path
 
-import mysql.connector
 import pandas as pd
-from dotenv import load_dotenv
+import pyarrow as pa
+import pyarrow.dataset as ds
+from pages.utils.cache import shared_cache
+from pages.utils.db import run_typed_query
+from pyarrow import fs
 
-_ = load_dotenv()
+# "mysql" queries the database, "parquet" reads the snapshot written by the ingestion pipeline
+TABLE_SOURCE = os.environ.get("DASHBOARD_TABLE_SOURCE", "mysql")
+SNAPSHOT_DIR = os.environ.get("DASHBOARD_SNAPSHOT_DIR", "snapshot/despesas")
 
+TABLE_COLUMNS = {
+    "nome_deputado": "despesas.nome_deputado",
+    "ano": "despesas.ano",
+    "mes": "despesas.mes",
+    "tipo_despesa": "despesas.tipo_despesa",
+    "valor_documento": "despesas.valor_documento",
+    "cnpj_cpf_fornecedor": "despesas.cnpj_cpf_fornecedor",
+    "sigla_partido": "deputados.sigla_partido",
+    "id_legislatura": "deputados.id_legislatura",
+    "sigla_uf": "deputados.sigla_uf",
+    "nome_fornecedor": "fornecedores.nome_fornecedor",
+}
+TABLE_DTYPES = {
+    "nome_deputado": "category",
+    "ano": "int16",
+    "mes": "int16",
+    "tipo_despesa": "category",
+    "valor_documento": "float64",
+    "cnpj_cpf_fornecedor": "category",
+    "sigla_partido": "category",
+    "id_legislatura": "Int16",
+    "sigla_uf": "category",
+    "nome_fornecedor": "category",
+}
+DICTIONARY_COLUMNS = [column for column, dtype in TABLE_DTYPES.items() if dtype == "category"]
 
-def get_table() -> pd.DataFrame:
-    db_config = {
-        "user": os.environ["DB_USER"],
-        "password": os.environ["DB_PASSWORD"],
-        "host": os.environ["DB_HOST"],
-        "port": int(os.environ["DB_PORT"]),
-        "database": os.environ["DB_NAME"],
-    }
 
-    query = """
+def _read_snapshot(anos: list[int] | None, columns: list[str]) -> pd.DataFrame:
+    dataset = ds.dataset(
+        SNAPSHOT_DIR,
+        format=ds.ParquetFileFormat(read_options={"dictionary_columns": DICTIONARY_COLUMNS}),
+        partitioning=ds.partitioning(pa.schema([("ano", pa.int16())]), flavor="hive"),
+        filesystem=fs.LocalFileSystem(use_mmap=True),
+    )
+    filter_ = None if anos is None else ds.field("ano").isin(anos)
+    df = dataset.to_table(columns=columns, filter=filter_).to_pandas()
+    return df.astype({column: TABLE_DTYPES[column] for column in columns})
+
+
+def _read_database(anos: list[int] | None, columns: list[str]) -> pd.DataFrame:
+    where = ""
+    params: list[int] = []
+    if anos is not None:
+        where = f"WHERE despesas.ano IN ({', '.join(['%s'] * len(anos))})" if anos else "WHERE 1 = 0"
+        params = list(anos)
+
+    query = f"""
         SELECT
-            despesas.nome_deputado,
-            despesas.ano,
-            despesas.mes,
-            despesas.tipo_despesa,
-            despesas.valor_documento,
-            despesas.cnpj_cpf_fornecedor,
-            deputados.sigla_partido,
-            deputados.id_legislatura,
-            deputados.sigla_uf,
-            fornecedores.nome_fornecedor
+            {", ".join(f"{TABLE_COLUMNS[column]} AS {column}" for column in columns)}
         FROM
             despesas
         LEFT JOIN
-            deputados ON despesas.nome_deputado = deputados.nome
+            deputados ON despesas.deputado_id = deputados.id
         LEFT JOIN
-            fornecedores ON despesas.cnpj_cpf_fornecedor = fornecedores.cnpj_cpf_fornecedor;
+            fornecedores ON despesas.fornecedor_id = fornecedores.id
+        {where};
     """
 
-    conn = None
-    try:
-        conn = mysql.connector.connect(**db_config)
-
-        if conn.is_connected():
-            print("Successfully connected to MySQL database")
+    return run_typed_query(query, params, TABLE_DTYPES)
 
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute(query)
-        query_results = cursor.fetchall()
 
-        df = pd.DataFrame(query_results)
+@shared_cache
+def get_table(
+    anos: list[int] | None = None,
+    columns: list[str] | None = None,
+    source: str = TABLE_SOURCE,
+) -> pd.DataFrame:
+    columns = [column for column in columns or TABLE_COLUMNS if column in TABLE_COLUMNS]
 
-        return df
+    if source == "parquet" and Path(SNAPSHOT_DIR).exists():
+        return _read_snapshot(anos, columns)
 
-    except mysql.connector.Error as err:
-        print(f"Error: {err}")
-        return pd.DataFrame()
-    finally:
-        if conn and conn.is_connected():
-            cursor.close()
-            conn.close()
-            print("MySQL connection closed.")
+    return _read_database(anos, columns)
@@ -0,0 +1,66 @@
+import argparse
+import re
+import time
+
+import httpx
+
+from data_ingestion.benchmarks.mock_api import MockCamaraAPI
+from data_ingestion.services.data_service import DataService
+from data_ingestion.services.log_service import logger
+
+
+def serial_get_all_pages(url: str | None) -> list[dict]:
+    items = []
+    while url:
+        response = httpx.get(url).json()
+        items.extend(response.get("dados"))
+        url = next((link["href"] for link in response.get("links", []) if link["rel"] == "next"), None)
+    return items
+
+
+def serial_get_data_from_api(api_base_url: str, anos: list[int]) -> list[dict]:
+    deputados = serial_get_all_pages(f"{api_base_url}/deputados")
+    despesas = []
+    for ano in anos:
+        for deputado in deputados:
+            for item in serial_get_all_pages(f"{api_base_url}/deputados/{deputado['id']}/despesas?ano={ano}"):
+                despesas.append({
+                    "nome_deputado": deputado.get("nome"),
+                    "cnpj_cpf_fornecedor": re.sub(r"[^0-9]", "", item.get("cnpjCpfFornecedor")),
+                    "valor_documento": item.get("valorDocumento"),
+                })
+
+    return despesas
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare the serial and async API fetchers against a mock server")
+    parser.add_argument("--deputados", type=int, default=50)
+    parser.add_argument("--despesas", type=int, default=250)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--anos", type=int, nargs="+", default=[2023, 2024])
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--rate-limit", type=float, default=1000.0)
+    args = parser.parse_args()
+
+    with MockCamaraAPI(deputados=args.deputados, despesas_por_ano=args.despesas, latency=args.latency) as api:
+        start = time.perf_counter()
+        serial_despesas = serial_get_data_from_api(api.base_url, args.anos)
+        serial_time = time.perf_counter() - start
+
+        data_service = DataService(
+            api_base_url=api.base_url,
+            max_concurrency=args.concurrency,
+            rate_limit=args.rate_limit,
+        )
+        start = time.perf_counter()
+        _, async_despesas, _ = data_service.get_data_from_api(anos=args.anos)
+        async_time = time.perf_counter() - start
+
+    logger.info(f"Serial: {len(serial_despesas)} despesas in {serial_time:.2f}s")
+    logger.info(f"Async:  {len(async_despesas)} despesas in {async_time:.2f}s")
+    logger.info(f"Speedup: {serial_time / async_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
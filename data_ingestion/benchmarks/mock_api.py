@@ -0,0 +1,291 @@
+import bisect
+import hashlib
+import itertools
+import json
+import math
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from collections.abc import Callable
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Self
+from urllib.parse import parse_qs, urlparse
+
+UFS = [
+    "AC", "AL", "AM", "AP", "BA", "CE", "DF", "ES", "GO", "MA", "MG", "MS", "MT", "PA",
+    "PB", "PE", "PI", "PR", "RJ", "RN", "RO", "RR", "RS", "SC", "SE", "SP", "TO",
+]  # fmt: skip
+PARTIDOS = [
+    "PL", "PT", "UNIÃO", "PP", "PSD", "REPUBLICANOS", "MDB", "PDT", "PSB", "PSDB",
+    "PSOL", "PODE", "AVANTE", "PCdoB", "PV", "CIDADANIA", "NOVO", "SOLIDARIEDADE", "PRD", "REDE",
+]  # fmt: skip
+# Expense types as published by the Câmara, weighted roughly by how often they appear
+TIPOS_DESPESA = [
+    ("COMBUSTÍVEIS E LUBRIFICANTES.", 30),
+    ("PASSAGEM AÉREA - SIGEPA", 15),
+    ("TELEFONIA", 10),
+    ("MANUTENÇÃO DE ESCRITÓRIO DE APOIO À ATIVIDADE PARLAMENTAR", 10),
+    ("FORNECIMENTO DE ALIMENTAÇÃO DO PARLAMENTAR", 8),
+    ("SERVIÇO DE TÁXI, PEDÁGIO E ESTACIONAMENTO", 7),
+    ("DIVULGAÇÃO DA ATIVIDADE PARLAMENTAR.", 5),
+    ("HOSPEDAGEM ,EXCETO DO PARLAMENTAR NO DISTRITO FEDERAL.", 4),
+    ("LOCAÇÃO OU FRETAMENTO DE VEÍCULOS AUTOMOTORES", 4),
+    ("SERVIÇOS POSTAIS", 3),
+    ("CONSULTORIAS, PESQUISAS E TRABALHOS TÉCNICOS.", 2),
+    ("ASSINATURA DE PUBLICAÇÕES", 1),
+    ("PASSAGENS TERRESTRES, MARÍTIMAS OU FLUVIAIS", 1),
+]
+TIPO_NAMES = [tipo for tipo, _ in TIPOS_DESPESA]
+TIPO_WEIGHTS = list(itertools.accumulate(weight for _, weight in TIPOS_DESPESA))
+FORNECEDORES = 20_000
+# Share of expenses partially refused (glosa) by the Câmara
+GLOSA_RATE = 0.05
+ZIP_CHUNK_SIZE = 1024 * 1024
+
+
+def make_deputado(deputado_id: int) -> dict:
+    return {
+        "id": deputado_id,
+        "nome": f"Deputado {deputado_id}",
+        "siglaPartido": PARTIDOS[deputado_id % len(PARTIDOS)],
+        "idLegislatura": 57,
+        "siglaUf": UFS[deputado_id % len(UFS)],
+    }
+
+
+def make_cnpj_cpf(fornecedor: int) -> str:
+    # One supplier in five is a person (CPF), a few have no document at all, as in the published files
+    if fornecedor % 50 == 0:
+        return ""
+    if fornecedor % 5 == 0:
+        cpf = f"{fornecedor * 7919 % 10**11:011d}"
+        return f"{cpf[:3]}.{cpf[3:6]}.{cpf[6:9]}-{cpf[9:]}"
+    cnpj = f"{fornecedor * 7919 % 10**8:08d}0001{fornecedor % 100:02d}"
+    return f"{cnpj[:2]}.{cnpj[2:5]}.{cnpj[5:8]}/{cnpj[8:12]}-{cnpj[12:]}"
+
+
+# Deterministic per (deputado, ano, index), so the API and the zip files describe the same expenses
+def make_despesa(deputado_id: int, ano: int, index: int, fornecedores: int = FORNECEDORES) -> dict:
+    rng = random.Random(deputado_id * 1_000_003 + ano * 10_007 + index)
+    tipo = TIPO_NAMES[bisect.bisect(TIPO_WEIGHTS, rng.random() * TIPO_WEIGHTS[-1])]
+    # A few suppliers get most of the expenses and values are log-normal with a long tail
+    fornecedor = int(fornecedores * rng.random() ** 3) + 1
+    valor = round(min(rng.lognormvariate(5, 1.2), 100_000.0), 2)
+    glosa = round(valor * rng.random() * 0.2, 2) if rng.random() < GLOSA_RATE else 0.0
+    mes = index % 12 + 1
+    return {
+        "ano": ano,
+        "mes": mes,
+        "tipoDespesa": tipo,
+        "dataDocumento": f"{ano}-{mes:02d}-{rng.randint(1, 28):02d}T00:00:00",
+        "numDocumento": f"{deputado_id}-{index}",
+        "valorDocumento": valor,
+        "cnpjCpfFornecedor": make_cnpj_cpf(fornecedor),
+        "nomeFornecedor": f"FORNECEDOR {fornecedor} LTDA" if fornecedor % 5 else f"PESSOA FÍSICA {fornecedor}",
+        "valorLiquido": round(valor - glosa, 2),
+        "valorGlosa": glosa,
+    }
+
+
+def make_cota(deputado_id: int, ano: int, index: int, fornecedores: int = FORNECEDORES) -> dict:
+    despesa = make_despesa(deputado_id, ano, index, fornecedores)
+    deputado = make_deputado(deputado_id)
+    return {
+        "nomeParlamentar": deputado["nome"],
+        "numeroDeputadoID": deputado_id,
+        "siglaUF": deputado["siglaUf"],
+        "siglaPartido": deputado["siglaPartido"],
+        "codigoLegislatura": deputado["idLegislatura"],
+        "descricao": despesa["tipoDespesa"],
+        "fornecedor": despesa["nomeFornecedor"],
+        "cnpjCPF": despesa["cnpjCpfFornecedor"],
+        "dataEmissao": despesa["dataDocumento"],
+        "numero": despesa["numDocumento"],
+        "valorDocumento": despesa["valorDocumento"],
+        "valorGlosa": despesa["valorGlosa"],
+        "valorLiquido": despesa["valorLiquido"],
+        "mes": despesa["mes"],
+        "ano": ano,
+    }
+
+
+# Written to disk, so files with millions of rows never have to fit in memory
+def write_cotas_zip(
+    path: str | Path, deputados: int, despesas_por_ano: int, ano: int, fornecedores: int = FORNECEDORES
+) -> None:
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+        with zip_file.open(f"Ano-{ano}.json", "w", force_zip64=True) as json_file:
+            json_file.write(b'{"dados":[')
+            for deputado_id in range(1, deputados + 1):
+                for index in range(despesas_por_ano):
+                    separator = b"," if deputado_id > 1 or index > 0 else b""
+                    cota = make_cota(deputado_id, ano, index, fornecedores)
+                    json_file.write(separator + json.dumps(cota).encode("utf-8"))
+            json_file.write(b"]}")
+
+
+class MockServer(ThreadingHTTPServer):
+    api: "MockCamaraAPI"
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    server: "MockServer"
+
+    @property
+    def api(self) -> "MockCamaraAPI":
+        return self.server.api
+
+    def log_message(self, *args: object) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        time.sleep(self.api.latency)
+        parsed = urlparse(self.path)
+        query = parse_qs(parsed.query)
+
+        if match := re.fullmatch(r"/cotas/Ano-(\d{4})\.json\.zip", parsed.path):
+            self._send_zip(int(match.group(1)))
+        elif parsed.path == "/deputados":
+            self._send_page(parsed.path, query, self.api.deputados, lambda position: make_deputado(position + 1))
+        elif match := re.fullmatch(r"/deputados/(\d+)/despesas", parsed.path):
+            deputado_id = int(match.group(1))
+            ano = int(query.get("ano", ["2024"])[0])
+            meses = {int(mes) for mes in query.get("mes", [])}
+            indexes = range(self.api.despesas_por_ano)
+            if meses:
+                indexes = [index for index in indexes if index % 12 + 1 in meses]
+            self._send_page(
+                parsed.path,
+                query,
+                len(indexes),
+                lambda position: make_despesa(deputado_id, ano, indexes[position], self.api.fornecedores),
+            )
+        else:
+            self.send_error(404)
+
+    def _send_zip(self, ano: int) -> None:
+        path, etag = self.api.get_zip(ano)
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Length", str(path.stat().st_size))
+        self.end_headers()
+        with path.open("rb") as file:
+            shutil.copyfileobj(file, self.wfile, ZIP_CHUNK_SIZE)
+
+    # Only the items of the requested page are generated, so deep pagination stays cheap
+    def _send_page(self, path: str, query: dict[str, list[str]], total: int, make_item: Callable[[int], dict]) -> None:
+        itens = min(int(query.get("itens", [self.api.default_page_size])[0]), self.api.max_page_size)
+        pagina = int(query.get("pagina", ["1"])[0])
+        last_page = max(math.ceil(total / itens), 1)
+        start = (pagina - 1) * itens
+        extra = "".join(
+            f"&{key}={value}" for key, values in query.items() if key not in {"pagina", "itens"} for value in values
+        )
+        base = f"{self.api.base_url}{path}"
+        body = {
+            "dados": [make_item(position) for position in range(start, min(start + itens, total))],
+            "links": [
+                {"rel": "self", "href": f"{base}?pagina={pagina}&itens={itens}{extra}"},
+                {"rel": "first", "href": f"{base}?pagina=1&itens={itens}{extra}"},
+                {"rel": "last", "href": f"{base}?pagina={last_page}&itens={itens}{extra}"},
+            ],
+        }
+        if pagina < last_page:
+            body["links"].append({"rel": "next", "href": f"{base}?pagina={pagina + 1}&itens={itens}{extra}"})
+
+        self._send(json.dumps(body).encode("utf-8"), "application/json")
+
+    def _send(self, payload: bytes, content_type: str, headers: dict[str, str] | None = None) -> None:
+        self.send_response(200)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class MockCamaraAPI:
+    """Local stand-in for the Câmara API, used to benchmark the fetchers without hitting the real endpoints."""
+
+    def __init__(
+        self,
+        deputados: int = 50,
+        despesas_por_ano: int = 20,
+        latency: float = 0.05,
+        default_page_size: int = 15,
+        max_page_size: int = 100,
+        fornecedores: int = FORNECEDORES,
+    ) -> None:
+        self.deputados = deputados
+        self.despesas_por_ano = despesas_por_ano
+        self.latency = latency
+        self.default_page_size = default_page_size
+        self.max_page_size = max_page_size
+        self.fornecedores = fornecedores
+        self.zip_dir: tempfile.TemporaryDirectory | None = None
+        self.zip_files: dict[int, tuple[Path, str]] = {}
+        self.zip_lock = threading.Lock()
+        self.server: MockServer | None = None
+        self.thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        if self.server is None:
+            msg = "Mock server is not running"
+            raise RuntimeError(msg)
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def zip_url(self, ano: int) -> str:
+        return f"{self.base_url}/cotas/Ano-{ano}.json.zip"
+
+    def get_zip(self, ano: int) -> tuple[Path, str]:
+        with self.zip_lock:
+            if ano not in self.zip_files:
+                if self.zip_dir is None:
+                    self.zip_dir = tempfile.TemporaryDirectory(prefix="mock-cotas-")
+                path = Path(self.zip_dir.name) / f"Ano-{ano}.json.zip"
+                write_cotas_zip(path, self.deputados, self.despesas_por_ano, ano, self.fornecedores)
+                digest = hashlib.sha1()
+                with path.open("rb") as file:
+                    for chunk in iter(lambda: file.read(ZIP_CHUNK_SIZE), b""):
+                        digest.update(chunk)
+                self.zip_files[ano] = (path, f'"{digest.hexdigest()}"')
+            return self.zip_files[ano]
+
+    def start(self) -> None:
+        self.server = MockServer(("127.0.0.1", 0), MockHandler)
+        self.server.api = self
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        if self.zip_dir is not None:
+            self.zip_dir.cleanup()
+            self.zip_dir = None
+            self.zip_files.clear()
+
+    def __enter__(self) -> Self:
+        self.start()
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.stop()
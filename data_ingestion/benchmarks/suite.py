@@ -0,0 +1,232 @@
+import argparse
+import datetime
+import importlib
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any
+
+from data_ingestion.benchmarks.mock_api import MockCamaraAPI
+from data_ingestion.services.data_service import DataService
+from data_ingestion.services.db_service import DBService
+from data_ingestion.services.duckdb_service import DuckDBService
+from data_ingestion.services.log_service import logger
+from data_ingestion.services.snapshot_service import SnapshotService
+from data_ingestion.utils.decorators import peak_rss_mb
+
+SCALES = [10_000, 1_000_000, 10_000_000]
+CASES = ["api", "url", "insert", "get_table", "aggregation", "duckdb"]
+DEPUTADOS = 513
+RESULTS_DIR = "benchmark_results"
+REGRESSION_THRESHOLD = 0.1
+DASHBOARD_DIR = Path(__file__).resolve().parents[2] / "dashboard"
+
+
+def _timed(function: Callable[[], int], repeat: int) -> tuple[list[float], int]:
+    seconds = []
+    rows = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = function()
+        seconds.append(time.perf_counter() - start)
+    return seconds, rows
+
+
+def _bench_api(base_url: str, anos: list[int], **_: Any) -> tuple[list[float], int]:
+    data_service = DataService(api_base_url=base_url, rate_limit=10_000.0, max_concurrency=20)
+    return _timed(lambda: len(data_service.get_data_from_api(anos=anos)[1]), 1)
+
+
+def _bench_url(zip_urls: list[str], **_: Any) -> tuple[list[float], int]:
+    return _timed(lambda: sum(len(DataService.get_data_from_url(url)[1]) for url in zip_urls), 1)
+
+
+# Only insert_data is timed; the batches are streamed from the zip files in between and not counted
+def _bench_insert(zip_urls: list[str], **_: Any) -> tuple[list[float], int]:
+    Path("database.db").unlink(missing_ok=True)
+    db_service = DBService(local=True)
+    db_service.create_schema()
+
+    elapsed = 0.0
+    rows = 0
+    for url in zip_urls:
+        for deputados, despesas, fornecedores in DataService.stream_data_from_url(url):
+            start = time.perf_counter()
+            db_service.insert_data(deputados=deputados, despesas=despesas, fornecedores=fornecedores)
+            elapsed += time.perf_counter() - start
+            rows += len(despesas)
+
+    # The dashboard cases read this snapshot, so they run without a MySQL server
+    db_service.refresh_rollups(full=True)
+    SnapshotService(db_service).write()
+    DuckDBService(db_service).write()
+    return [elapsed], rows
+
+
+def _dashboard_table() -> Callable[..., Any]:
+    os.environ["DASHBOARD_SNAPSHOT_DIR"] = str(Path("snapshot/despesas").resolve())
+    sys.path.append(str(DASHBOARD_DIR))
+    table = importlib.import_module("pages.utils.table")
+
+    # The undecorated function, so every run reads the snapshot instead of the shared cache
+    return table.get_table.__wrapped__
+
+
+def _bench_get_table(repeat: int, **_: Any) -> tuple[list[float], int]:
+    get_table = _dashboard_table()
+    return _timed(lambda: len(get_table(source="parquet")), repeat)
+
+
+def _bench_aggregation(repeat: int, **_: Any) -> tuple[list[float], int]:
+    df = _dashboard_table()(source="parquet")
+    create_bar_plot = importlib.import_module("pages.utils.plots").create_bar_plot
+
+    def aggregate() -> int:
+        for y in ["nome_deputado", "tipo_despesa", "sigla_uf", "nome_fornecedor"]:
+            create_bar_plot(df, "valor_documento", y, "Valor", y, y, limit=10)
+        return len(df)
+
+    return _timed(aggregate, repeat)
+
+
+# The same groupings as the aggregation case, with their medians, run as SQL on the DuckDB copy
+def _bench_duckdb(repeat: int, **_: Any) -> tuple[list[float], int]:
+    os.environ["DASHBOARD_ENGINE"] = "duckdb"
+    os.environ["DASHBOARD_DUCKDB_PATH"] = str(Path("analytics.duckdb").resolve())
+    sys.path.append(str(DASHBOARD_DIR))
+    queries = importlib.import_module("pages.utils.queries")
+
+    def aggregate() -> int:
+        for key in ["nome_deputado", "tipo_despesa", "sigla_uf", "nome_fornecedor"]:
+            queries.aggregate_by.__wrapped__((key,))
+            queries.median_by.__wrapped__((key,))
+        return importlib.import_module("pages.utils.pagination").count_rows.__wrapped__()
+
+    return _timed(aggregate, repeat)
+
+
+BENCHMARKS = {
+    "api": _bench_api,
+    "url": _bench_url,
+    "insert": _bench_insert,
+    "get_table": _bench_get_table,
+    "aggregation": _bench_aggregation,
+    "duckdb": _bench_duckdb,
+}
+
+
+def run_case(case: str, workdir: str, **kwargs: Any) -> dict:
+    os.chdir(workdir)
+    baseline = peak_rss_mb()
+    seconds, rows = BENCHMARKS[case](**kwargs)
+    median = statistics.median(seconds)
+    return {
+        "case": case,
+        "rows": rows,
+        "runs": len(seconds),
+        "latency_s": {"min": min(seconds), "median": median, "max": max(seconds)},
+        "rows_per_s": rows / median if median else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "baseline_rss_mb": baseline,
+    }
+
+
+def run_scale(scale: int, cases: list[str], anos: list[int], latency: float, repeat: int) -> list[dict]:
+    deputados = min(DEPUTADOS, scale)
+    despesas_por_ano = max(round(scale / (deputados * len(anos))), 1)
+    results = []
+    # Every case runs in a fresh process, so peak memory is measured per case and not inherited from the last one
+    context = multiprocessing.get_context("spawn")
+    with (
+        tempfile.TemporaryDirectory(prefix="benchmark-") as workdir,
+        MockCamaraAPI(deputados=deputados, despesas_por_ano=despesas_por_ano, latency=latency) as api,
+    ):
+        kwargs = {
+            "base_url": api.base_url,
+            "zip_urls": [api.zip_url(ano) for ano in anos],
+            "anos": anos,
+            "repeat": repeat,
+        }
+        ordered = [case for case in CASES if case in cases]
+        # The dashboard cases read what the insert case loaded
+        if {"get_table", "aggregation", "duckdb"} & set(ordered) and "insert" not in ordered:
+            ordered.insert(0, "insert")
+
+        for case in ordered:
+            logger.info(f"Benchmark {case} at {scale} rows")
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                result = executor.submit(run_case, case, workdir, **kwargs).result()
+            result["scale"] = scale
+            logger.info(
+                f"{case}: {result['rows']} rows, {result['latency_s']['median']:.2f}s, "
+                f"{result['rows_per_s'] or 0:.0f} rows/s, {result['peak_rss_mb']:.0f} MB peak"
+            )
+            if case in cases:
+                results.append(result)
+    return results
+
+
+def compare(results: list[dict], baseline_path: Path, threshold: float = REGRESSION_THRESHOLD) -> list[str]:
+    baseline = {(r["case"], r["scale"]): r for r in json.loads(baseline_path.read_text(encoding="utf-8"))["results"]}
+    regressions = []
+    for result in results:
+        previous = baseline.get((result["case"], result["scale"]))
+        if previous is None:
+            continue
+        for metric, current, before in [
+            ("latency", result["latency_s"]["median"], previous["latency_s"]["median"]),
+            ("peak memory", result["peak_rss_mb"], previous["peak_rss_mb"]),
+        ]:
+            change = current / before - 1 if before else 0.0
+            logger.info(f"{result['case']} at {result['scale']} rows: {metric} {change:+.1%}")
+            if change > threshold:
+                regressions.append(f"{result['case']} at {result['scale']} rows: {metric} {change:+.1%}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Time ingestion and dashboard hot paths on synthetic data")
+    parser.add_argument("--scales", type=int, nargs="+", default=SCALES, help="approximate number of despesas")
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=CASES)
+    parser.add_argument("--anos", type=int, nargs="+", default=[2024])
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every mock response")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of the dashboard cases")
+    parser.add_argument("--output", type=Path, help="JSON file for the results")
+    parser.add_argument("--compare", type=Path, help="previous results to check for regressions")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    results = []
+    for scale in args.scales:
+        results.extend(run_scale(scale, args.cases, args.anos, args.latency, args.repeat))
+
+    now = datetime.datetime.now(tz=datetime.UTC)
+    output = args.output or Path(RESULTS_DIR) / f"{now:%Y%m%dT%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    report = {
+        "created_at": now.isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    logger.info(f"Results saved to {output}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            logger.error(f"Regressions above {args.threshold:.0%}: {'; '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,369 @@
-import os
-
-from dotenv import load_dotenv
-
-from data_ingestion.services.data_service import DataService
-from data_ingestion.services.db_service import DBService
-
-_ = load_dotenv()
-
-
-def main() -> None:
-    url = "https://www.camara.leg.br/cotas/Ano-2022.json.zip"
-    anos = [2023, 2024]
-
-    data_service = DataService()
-    api_deputados, api_despesas, api_fornecedores = data_service.get_data_from_api(anos=anos)
-    url_deputados, url_despesas, url_fornecedores = data_service.get_data_from_url(url=url)
-
-    deputados = [*api_deputados, *url_deputados]
-    despesas = [*api_despesas, *url_despesas]
-    fornecedores = [*api_fornecedores, *url_fornecedores]
-
-    db_service = DBService(
-        user=os.environ["DB_USER"],
-        password=os.environ["DB_PASSWORD"],
-        host=os.environ["DB_HOST"],
-        port=int(os.environ["DB_PORT"]),
-        dbname=os.environ["DB_NAME"],
-    )
-    db_service.insert_data(deputados=deputados, despesas=despesas, fornecedores=fornecedores)
-
-
-if __name__ == "__main__":
-    main()
+import argparse
+import datetime
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+
+from dotenv import load_dotenv
+
+from data_ingestion.services.anomaly_service import MODEL_PATH, AnomalyService
+from data_ingestion.services.cache_service import CACHE_TTL, ResponseCache
+from data_ingestion.services.checkpoint_service import CheckpointService
+from data_ingestion.services.data_service import BATCH_SIZE, COTAS_URL, DataService
+from data_ingestion.services.db_service import DBService
+from data_ingestion.services.dead_letter_service import DEAD_LETTER_PATH, DeadLetterService
+from data_ingestion.services.duckdb_service import DUCKDB_PATH, DuckDBService
+from data_ingestion.services.log_service import logger
+from data_ingestion.services.pipeline_service import PUT_TIMEOUT, QUEUE_SIZE, PipelineService
+from data_ingestion.services.snapshot_service import SNAPSHOT_DIR, SnapshotService
+from data_ingestion.utils.decorators import metrics
+
+_ = load_dotenv()
+
+
+def get_db_service() -> DBService:
+    return DBService(
+        user=os.environ["DB_USER"],
+        password=os.environ["DB_PASSWORD"],
+        host=os.environ["DB_HOST"],
+        port=int(os.environ["DB_PORT"]),
+        dbname=os.environ["DB_NAME"],
+    )
+
+
+def refresh_outputs(
+    db_service: DBService,
+    snapshot: SnapshotService | None = None,
+    full: bool = False,
+    analytics: DuckDBService | None = None,
+) -> None:
+    anos = None if full else {ano for ano, _ in db_service.dirty_partitions}
+    db_service.refresh_rollups(full=full)
+    if snapshot is not None:
+        snapshot.write(anos)
+    if analytics is not None:
+        analytics.write(anos)
+
+
+def ingest_year(
+    ano: int,
+    batches: queue.Queue,
+    batch_size: int = BATCH_SIZE,
+    cache_dir: str | None = None,
+    cache_ttl: float = CACHE_TTL,
+    dead_letter_path: str | None = None,
+    stop: threading.Event | None = None,
+) -> tuple[int, dict]:
+    # Workers are reused across years, so each year reports only its own stages
+    metrics.reset()
+    cache = ResponseCache(cache_dir, ttl=cache_ttl) if cache_dir else None
+    dead_letters = DeadLetterService(dead_letter_path) if dead_letter_path else None
+
+    total = 0
+    try:
+        for deputados, despesas, fornecedores in DataService.stream_data_from_url(
+            url=COTAS_URL.format(ano=ano), batch_size=batch_size, cache=cache, dead_letters=dead_letters
+        ):
+            if not PipelineService.put(batches, (deputados, despesas, fornecedores), stop):
+                break
+            total += len(despesas)
+    finally:
+        PipelineService.put(batches, None, stop)
+
+    if cache is not None:
+        cache.log_stats()
+    if dead_letters is not None:
+        dead_letters.log_stats()
+
+    return total, metrics.report()
+
+
+def write_bulk_batches(db_service: DBService, batches: queue.Queue, futures: list[Future]) -> None:
+    finished = 0
+    exhausted = False
+    while finished < len(futures):
+        try:
+            batch = batches.get(timeout=PUT_TIMEOUT)
+        except queue.Empty:
+            # A worker that died never sends its None. Once every future is done nothing else can be queued,
+            # so the queue is read until it is empty once more and then the writer stops.
+            if exhausted:
+                return
+            exhausted = all(future.done() for future in futures)
+            continue
+        if batch is None:
+            finished += 1
+            continue
+        deputados, despesas, fornecedores = batch
+        db_service.insert_data(deputados=deputados, despesas=despesas, fornecedores=fornecedores)
+
+
+def run_bulk(
+    db_service: DBService,
+    anos: list[int],
+    workers: int,
+    batch_size: int = BATCH_SIZE,
+    cache_dir: str | None = None,
+    cache_ttl: float = CACHE_TTL,
+    snapshot: SnapshotService | None = None,
+    dead_letter_path: str | None = None,
+    analytics: DuckDBService | None = None,
+) -> None:
+    start = time.perf_counter()
+    with multiprocessing.Manager() as manager, ProcessPoolExecutor(max_workers=workers) as executor:
+        batches = manager.Queue(maxsize=workers * 2)
+        stop = manager.Event()
+        futures = [
+            executor.submit(ingest_year, ano, batches, batch_size, cache_dir, cache_ttl, dead_letter_path, stop)
+            for ano in anos
+        ]
+
+        try:
+            write_bulk_batches(db_service, batches, futures)
+        except BaseException:
+            # Workers blocked on the full queue give up once the writer stops, so the executor can shut down
+            stop.set()
+            for future in futures:
+                future.cancel()
+            # The batches written before the failure still need their rollups
+            refresh_outputs(db_service, snapshot, analytics=analytics)
+            raise
+
+        total = 0
+        for ano, future in zip(anos, futures, strict=True):
+            try:
+                rows, report = future.result()
+            except Exception:
+                logger.exception(f"Bulk ingestion failed for year {ano}")
+            else:
+                total += rows
+                metrics.merge(report)
+
+    refresh_outputs(db_service, snapshot, analytics=analytics)
+    logger.info(f"Bulk ingestion of {total} despesas from {len(anos)} years in {time.perf_counter() - start:.1f}s")
+
+
+def run_pipeline(
+    db_service: DBService,
+    data_service: DataService,
+    anos: list[int],
+    urls: list[str],
+    queue_size: int = QUEUE_SIZE,
+    snapshot: SnapshotService | None = None,
+    analytics: DuckDBService | None = None,
+) -> None:
+    sources = {"api": partial(data_service.stream_data_from_api, anos=anos)}
+    for url in urls:
+        sources[url] = partial(
+            data_service.stream_data_from_url, url=url, cache=data_service.cache, dead_letters=data_service.dead_letters
+        )
+
+    # A failed source is raised once the other sources' batches are written, and those still need their rollups
+    try:
+        PipelineService(queue_size).run(sources, lambda batch: db_service.insert_data(*batch))
+    finally:
+        refresh_outputs(db_service, snapshot, analytics=analytics)
+
+
+def run_incremental(
+    db_service: DBService,
+    data_service: DataService,
+    anos: list[int],
+    urls: list[str],
+    checkpoints: CheckpointService,
+    queue_size: int = QUEUE_SIZE,
+    snapshot: SnapshotService | None = None,
+    analytics: DuckDBService | None = None,
+) -> None:
+    sources = {"api": partial(data_service.stream_new_data_from_api, anos=anos, checkpoints=checkpoints)}
+    for url in urls:
+        sources[url] = partial(
+            data_service.stream_new_data_from_url,
+            url,
+            checkpoints,
+            cache=data_service.cache,
+            dead_letters=data_service.dead_letters,
+        )
+
+    # Checkpoints only advance once every batch they cover has been written, the rollups are refreshed regardless
+    try:
+        PipelineService(queue_size).run(sources, lambda batch: db_service.insert_data(*batch))
+    finally:
+        refresh_outputs(db_service, snapshot, analytics=analytics)
+    checkpoints.save()
+
+
+# Only the deputados and files that failed are fetched again. Rejected items are left in the file for inspection,
+# fetching them again would give the same items.
+def run_retry(
+    db_service: DBService,
+    data_service: DataService,
+    dead_letters: DeadLetterService,
+    queue_size: int = QUEUE_SIZE,
+    snapshot: SnapshotService | None = None,
+    analytics: DuckDBService | None = None,
+) -> None:
+    entries = dead_letters.read({"deputado", "url"})
+    if not entries:
+        logger.info(f"No failed requests to retry in {dead_letters.path}")
+        return
+
+    failed: dict[int, dict[int, int]] = {}
+    urls = []
+    for entry in entries:
+        if entry["kind"] == "url":
+            urls.append(entry["url"])
+            continue
+        mes_inicios = failed.setdefault(entry["ano"], {})
+        mes_inicios[entry["deputado_id"]] = min(mes_inicios.get(entry["deputado_id"], 12), entry["mes_inicio"])
+
+    sources = {}
+    if failed:
+        sources["api"] = partial(data_service.stream_failed_from_api, failed)
+    for url in dict.fromkeys(urls):
+        sources[url] = partial(
+            data_service.stream_data_from_url, url=url, cache=data_service.cache, dead_letters=dead_letters
+        )
+    logger.info(f"Retrying {sum(map(len, failed.values()))} deputado years and {len(sources) - bool(failed)} files")
+
+    # Whatever fails again is written as a new entry, so the entries taken here can all be removed
+    try:
+        PipelineService(queue_size).run(sources, lambda batch: db_service.insert_data(*batch))
+    finally:
+        refresh_outputs(db_service, snapshot, analytics=analytics)
+    dead_letters.remove(entries)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Ingest Câmara dos Deputados expenses into the database")
+    parser.add_argument("--migrate", action="store_true", help="upgrade an existing database to the current schema")
+    parser.add_argument("--refresh-rollups", action="store_true", help="rebuild the aggregated tables from scratch")
+    parser.add_argument(
+        "--score-anomalies",
+        action="store_true",
+        help="score despesas not scored yet, training the model if it is stale",
+    )
+    parser.add_argument("--retrain-anomalies", action="store_true", help="retrain the anomaly model and rescore")
+    parser.add_argument("--anomaly-model", default=MODEL_PATH, help="file of the persisted anomaly model")
+    parser.add_argument("--bulk", action="store_true", help="backfill a range of years from the annual zip files")
+    parser.add_argument("--start-year", type=int, default=2009)
+    parser.add_argument("--end-year", type=int, default=datetime.datetime.now(tz=datetime.UTC).year)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument(
+        "--queue-size", type=int, default=QUEUE_SIZE, help="batches fetched ahead of the database writer"
+    )
+    parser.add_argument("--incremental", action="store_true", help="only fetch and upsert new or changed data")
+    parser.add_argument("--checkpoints", default="checkpoints.json", help="watermark file used by --incremental")
+    parser.add_argument("--cache-dir", default=".cache/http", help="directory of the HTTP response cache")
+    parser.add_argument(
+        "--cache-ttl", type=float, default=CACHE_TTL, help="seconds before a cached response is revalidated"
+    )
+    parser.add_argument("--no-cache", action="store_true", help="always hit the network")
+    parser.add_argument("--snapshot-dir", default=SNAPSHOT_DIR, help="directory of the Parquet snapshot")
+    parser.add_argument("--no-snapshot", action="store_true", help="skip writing the Parquet snapshot")
+    parser.add_argument(
+        "--duckdb",
+        nargs="?",
+        const=DUCKDB_PATH,
+        help=f"also keep a DuckDB copy of the tables for the dashboard ({DUCKDB_PATH} if no file is given)",
+    )
+    parser.add_argument(
+        "--dead-letters", default=DEAD_LETTER_PATH, help="JSON Lines file of the items and requests that failed"
+    )
+    parser.add_argument(
+        "--retry-dead-letters", action="store_true", help="fetch again only the deputados and files that failed"
+    )
+    parser.add_argument(
+        "--metrics-file", help="write per-stage metrics at the end, as Prometheus text if it ends in .prom"
+    )
+    parser.add_argument(
+        "--profile-stage", action="append", default=[], help="cProfile every call of this stage (repeatable)"
+    )
+    args = parser.parse_args()
+
+    metrics.profile_stages.update(args.profile_stage)
+    try:
+        run(args)
+    finally:
+        metrics.log_summary()
+        if args.metrics_file:
+            metrics.write(args.metrics_file)
+
+
+def run(args: argparse.Namespace) -> None:
+    db_service = get_db_service()
+    snapshot = None if args.no_snapshot else SnapshotService(db_service, args.snapshot_dir)
+    analytics = DuckDBService(db_service, args.duckdb) if args.duckdb else None
+
+    if args.migrate:
+        db_service.migrate()
+        refresh_outputs(db_service, snapshot, full=True, analytics=analytics)
+        return
+
+    if args.refresh_rollups:
+        refresh_outputs(db_service, snapshot, full=True, analytics=analytics)
+        return
+
+    if args.score_anomalies or args.retrain_anomalies:
+        AnomalyService(db_service, args.anomaly_model).run(retrain=args.retrain_anomalies)
+        if analytics is not None:
+            analytics.write(anos=[], anomalies=True)
+        return
+
+    if args.bulk:
+        run_bulk(
+            db_service=db_service,
+            anos=list(range(args.start_year, args.end_year + 1)),
+            workers=args.workers,
+            batch_size=args.batch_size,
+            cache_dir=None if args.no_cache else args.cache_dir,
+            cache_ttl=args.cache_ttl,
+            snapshot=snapshot,
+            dead_letter_path=args.dead_letters,
+            analytics=analytics,
+        )
+        return
+
+    url = COTAS_URL.format(ano=2022)
+    anos = [2023, 2024]
+
+    cache = None if args.no_cache else ResponseCache(args.cache_dir, ttl=args.cache_ttl)
+    dead_letters = DeadLetterService(args.dead_letters)
+    data_service = DataService(cache=cache, dead_letters=dead_letters)
+
+    if args.retry_dead_letters:
+        run_retry(db_service, data_service, dead_letters, args.queue_size, snapshot, analytics)
+    elif args.incremental:
+        run_incremental(
+            db_service=db_service,
+            data_service=data_service,
+            anos=anos,
+            urls=[url],
+            checkpoints=CheckpointService(args.checkpoints),
+            queue_size=args.queue_size,
+            snapshot=snapshot,
+            analytics=analytics,
+        )
+    else:
+        run_pipeline(
+            db_service=db_service,
+            data_service=data_service,
+            anos=anos,
+            urls=[url],
+            queue_size=args.queue_size,
+            snapshot=snapshot,
+            analytics=analytics,
+        )
+
+    if cache is not None:
+        cache.log_stats()
+    dead_letters.log_stats()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import datetime
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import IsolationForest
+from sklearn.preprocessing import OrdinalEncoder
+from sqlalchemy import Select, delete, exists, func, or_, select
+
+from data_ingestion.services.db_service import DBService, Deputados, Despesas, DespesasAnomalias, Fornecedores
+from data_ingestion.services.log_service import logger
+
+MODEL_PATH = "models/anomalias.joblib"
+CATEGORICAL_COLUMNS = ["nome_deputado", "tipo_despesa", "sigla_partido", "sigla_uf", "nome_fornecedor"]
+NUMERIC_COLUMNS = ["ano", "mes", "valor_documento"]
+N_ESTIMATORS = 100
+CONTAMINATION = 0.01
+MAX_SAMPLES = 256
+TRAIN_SAMPLE_SIZE = 200_000
+SCORE_CHUNK_SIZE = 50_000
+RETRAIN_AFTER = datetime.timedelta(days=30)
+
+
+class AnomalyService:
+    """IsolationForest over the joined expenses, persisted to disk and applied only to rows not scored yet."""
+
+    def __init__(
+        self,
+        db_service: DBService,
+        path: str | Path = MODEL_PATH,
+        n_jobs: int = -1,
+        chunk_size: int = SCORE_CHUNK_SIZE,
+        sample_size: int = TRAIN_SAMPLE_SIZE,
+    ) -> None:
+        self.db_service = db_service
+        self.path = Path(path)
+        self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
+        self.sample_size = sample_size
+        self.artifact: dict[str, Any] | None = None
+
+    @staticmethod
+    def _select() -> Select:
+        return (
+            select(
+                Despesas.id,
+                Despesas.nome_deputado,
+                Despesas.ano,
+                Despesas.mes,
+                Despesas.tipo_despesa,
+                Despesas.valor_documento,
+                Deputados.sigla_partido,
+                Deputados.sigla_uf,
+                Fornecedores.nome_fornecedor,
+            )
+            .outerjoin(Deputados, Despesas.deputado_id == Deputados.id)
+            .outerjoin(Fornecedores, Despesas.fornecedor_id == Fornecedores.id)
+        )
+
+    def _read(self, stmt: Select) -> pd.DataFrame:
+        with self.db_service.engine.connect() as connection:
+            result = connection.execute(stmt)
+            return pd.DataFrame(result.all(), columns=list(result.keys()))
+
+    @staticmethod
+    def _features(encoder: OrdinalEncoder, frame: pd.DataFrame) -> np.ndarray:
+        categorical = encoder.transform(frame[CATEGORICAL_COLUMNS].fillna("").astype(str))
+        numeric = frame[NUMERIC_COLUMNS].apply(pd.to_numeric, errors="coerce").fillna(0).to_numpy(dtype="float64")
+        return np.hstack([categorical, numeric])
+
+    def load(self) -> dict[str, Any] | None:
+        if self.artifact is None and self.path.exists():
+            self.artifact = joblib.load(self.path)
+        return self.artifact
+
+    def needs_training(self, max_age: datetime.timedelta = RETRAIN_AFTER) -> bool:
+        artifact = self.load()
+        return artifact is None or datetime.datetime.now(tz=datetime.UTC) - artifact["treinado_em"] > max_age
+
+    # A strided sample by id keeps training cost flat however large despesas grows
+    def train(self) -> None:
+        start = time.perf_counter()
+        self.db_service.create_schema()
+        with self.db_service.engine.connect() as connection:
+            total = connection.scalar(select(func.count()).select_from(Despesas)) or 0
+            versao = connection.scalar(select(func.max(DespesasAnomalias.modelo_versao))) or 0
+        step = max(total // self.sample_size, 1)
+        sample = self._read(self._select().where(Despesas.id % step == 0).limit(self.sample_size))
+        if sample.empty:
+            logger.warning("Sem despesas para treinar o modelo de anomalias")
+            return
+
+        # Names never seen in training, such as new suppliers, are encoded as -1 instead of failing
+        encoder = OrdinalEncoder(handle_unknown="use_encoded_value", unknown_value=-1, dtype=np.float64)
+        encoder.fit(sample[CATEGORICAL_COLUMNS].fillna("").astype(str))
+        model = IsolationForest(
+            n_estimators=N_ESTIMATORS,
+            contamination=CONTAMINATION,
+            max_samples=MAX_SAMPLES,
+            n_jobs=self.n_jobs,
+            random_state=42,
+        )
+        model.fit(self._features(encoder, sample))
+
+        # A new version makes score() revisit every row scored by a previous model
+        previous = self.load()
+        artifact = {
+            "versao": max(versao, previous["versao"] if previous else 0) + 1,
+            "treinado_em": datetime.datetime.now(tz=datetime.UTC),
+            "encoder": encoder,
+            "model": model,
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=self.path.parent, suffix=".tmp", delete=False) as tmp_file:
+            joblib.dump(artifact, tmp_file)
+        Path(tmp_file.name).replace(self.path)
+        self.artifact = artifact
+        logger.info(
+            f"Modelo de anomalias treinado com {len(sample)} de {total} despesas em {time.perf_counter() - start:.2f}s"
+        )
+
+    def _score_chunk(self, artifact: dict[str, Any], frame: pd.DataFrame) -> pd.DataFrame:
+        features = self._features(artifact["encoder"], frame)
+        # Trees are evaluated in parallel over slices of the chunk, threads share the model without copying it
+        parts = np.array_split(features, max(min(joblib.effective_n_jobs(self.n_jobs), len(features)), 1))
+        scores = joblib.Parallel(n_jobs=self.n_jobs, prefer="threads")(
+            joblib.delayed(artifact["model"].decision_function)(part) for part in parts
+        )
+        score = np.concatenate(scores)
+        return pd.DataFrame({
+            "despesa_id": frame["id"],
+            "score": score,
+            "anomalia": (score < 0).astype("int64"),
+            "modelo_versao": artifact["versao"],
+        })
+
+    # Rows without a score, or scored by an older model, are read by id in chunks and upserted
+    def score(self) -> int:
+        artifact = self.load()
+        if artifact is None:
+            logger.warning(f"Modelo de anomalias não encontrado em {self.path}")
+            return 0
+
+        self.db_service.create_schema()
+        with self.db_service.engine.begin() as connection:
+            connection.execute(
+                delete(DespesasAnomalias).where(~exists().where(Despesas.id == DespesasAnomalias.despesa_id))
+            )
+
+        start = time.perf_counter()
+        pending = self._select().outerjoin(DespesasAnomalias, DespesasAnomalias.despesa_id == Despesas.id)
+        pending = pending.where(
+            or_(DespesasAnomalias.despesa_id.is_(None), DespesasAnomalias.modelo_versao != artifact["versao"])
+        )
+        rows = 0
+        flagged = 0
+        last_id = 0
+        while True:
+            chunk = self._read(pending.where(Despesas.id > last_id).order_by(Despesas.id).limit(self.chunk_size))
+            if chunk.empty:
+                break
+            scores = self._score_chunk(artifact, chunk)
+            self.db_service.upsert_frame(DespesasAnomalias, scores)
+            rows += len(scores)
+            flagged += int(scores["anomalia"].sum())
+            last_id = int(chunk["id"].iloc[-1])
+
+        logger.info(f"Anomalias: {flagged} de {rows} despesas sinalizadas em {time.perf_counter() - start:.2f}s")
+        return rows
+
+    def run(self, retrain: bool = False) -> int:
+        if retrain or self.needs_training():
+            self.train()
+        return self.score()
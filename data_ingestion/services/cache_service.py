@@ -0,0 +1,169 @@
+import hashlib
+import json
+import shutil
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import IO, Any
+from urllib.parse import urlencode
+
+from data_ingestion.services.log_service import logger
+
+CACHE_TTL = 6 * 3600
+
+
+@dataclass
+class CacheEntry:
+    key: str
+    url: str
+    stored_at: float
+    last_access: float
+    size: int
+    etag: str | None = None
+    last_modified: str | None = None
+
+
+class ResponseCache:
+    """On-disk HTTP response cache keyed by URL and query, with TTL, LRU eviction and conditional revalidation."""
+
+    def __init__(
+        self,
+        directory: str | Path = ".cache/http",
+        ttl: float = CACHE_TTL,
+        max_bytes: int = 5 * 1024**3,
+    ) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "revalidated": 0, "bytes_saved": 0}
+        self.total_bytes = sum(entry.size for entry in self._entries())
+        # The API and zip sources of the ingestion pipeline share one cache from separate threads
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(url: str, params: dict[str, Any] | None = None) -> str:
+        query = urlencode(sorted((params or {}).items()), doseq=True)
+        return hashlib.sha256(f"{url}?{query}".encode()).hexdigest()
+
+    def _body_path(self, key: str) -> Path:
+        return self.directory / f"{key}.body"
+
+    def _meta_path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def _entries(self) -> list[CacheEntry]:
+        entries = []
+        for meta_path in self.directory.glob("*.json"):
+            try:
+                entries.append(CacheEntry(**json.loads(meta_path.read_text(encoding="utf-8"))))
+            except (OSError, ValueError, TypeError):
+                continue
+        return entries
+
+    def _write_meta(self, entry: CacheEntry) -> None:
+        with tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", dir=self.directory, suffix=".tmp", delete=False
+        ) as tmp_file:
+            json.dump(asdict(entry), tmp_file)
+        Path(tmp_file.name).replace(self._meta_path(entry.key))
+
+    def get(self, url: str, params: dict[str, Any] | None = None) -> CacheEntry | None:
+        key = self.make_key(url, params)
+        try:
+            entry = CacheEntry(**json.loads(self._meta_path(key).read_text(encoding="utf-8")))
+        except (OSError, ValueError, TypeError):
+            return None
+        if not self._body_path(key).exists():
+            return None
+        return entry
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        return time.time() - entry.stored_at < self.ttl
+
+    @staticmethod
+    def validators(entry: CacheEntry | None) -> dict[str, str]:
+        headers = {}
+        if entry is not None and entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry is not None and entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def hit(self, entry: CacheEntry, revalidated: bool = False) -> None:
+        with self._lock:
+            self.stats["revalidated" if revalidated else "hits"] += 1
+            self.stats["bytes_saved"] += entry.size
+        entry.last_access = time.time()
+        if revalidated:
+            entry.stored_at = entry.last_access
+        self._write_meta(entry)
+
+    def miss(self) -> None:
+        with self._lock:
+            self.stats["misses"] += 1
+
+    def read_bytes(self, entry: CacheEntry) -> bytes:
+        return self._body_path(entry.key).read_bytes()
+
+    def copy_to(self, entry: CacheEntry, file: IO[bytes]) -> None:
+        with self._body_path(entry.key).open("rb") as body:
+            shutil.copyfileobj(body, file)
+        file.seek(0)
+
+    def _store(self, url: str, params: dict[str, Any] | None, tmp_path: Path, headers: dict[str, str]) -> CacheEntry:
+        key = self.make_key(url, params)
+        previous = self.get(url, params)
+        size = tmp_path.stat().st_size
+        tmp_path.replace(self._body_path(key))
+
+        now = time.time()
+        entry = CacheEntry(
+            key=key,
+            url=url,
+            stored_at=now,
+            last_access=now,
+            size=size,
+            etag=headers.get("ETag") or headers.get("etag"),
+            last_modified=headers.get("Last-Modified") or headers.get("last-modified"),
+        )
+        self._write_meta(entry)
+
+        with self._lock:
+            self.total_bytes += size - (previous.size if previous else 0)
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+        return entry
+
+    def store_bytes(self, url: str, params: dict[str, Any] | None, body: bytes, headers: dict[str, str]) -> CacheEntry:
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False) as tmp_file:
+            tmp_file.write(body)
+        return self._store(url, params, Path(tmp_file.name), headers)
+
+    def store_file(
+        self, url: str, params: dict[str, Any] | None, file: IO[bytes], headers: dict[str, str]
+    ) -> CacheEntry:
+        file.seek(0)
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False) as tmp_file:
+            shutil.copyfileobj(file, tmp_file)
+        file.seek(0)
+        return self._store(url, params, Path(tmp_file.name), headers)
+
+    def evict(self) -> None:
+        entries = sorted(self._entries(), key=lambda entry: entry.last_access)
+        self.total_bytes = sum(entry.size for entry in entries)
+        for entry in entries:
+            if self.total_bytes <= self.max_bytes:
+                break
+            self._meta_path(entry.key).unlink(missing_ok=True)
+            self._body_path(entry.key).unlink(missing_ok=True)
+            self.total_bytes -= entry.size
+            logger.info(f"Evicted {entry.url} from the response cache")
+
+    def log_stats(self) -> None:
+        logger.info(
+            f"Response cache: {self.stats['hits']} hits, {self.stats['revalidated']} revalidated, "
+            f"{self.stats['misses']} misses, {self.stats['bytes_saved'] / 1024**2:.1f} MB saved"
+        )
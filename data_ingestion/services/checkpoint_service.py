@@ -0,0 +1,42 @@
+import hashlib
+import json
+from pathlib import Path
+from typing import Any
+
+from data_ingestion.services.log_service import logger
+
+
+def content_hash(data: Any) -> str:
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class CheckpointService:
+    """Watermarks of what has already been ingested, persisted as a JSON file between runs."""
+
+    def __init__(self, path: str | Path = "checkpoints.json") -> None:
+        self.path = Path(path)
+        self.data: dict[str, dict[str, Any]] = {"api": {}, "url": {}}
+        if self.path.exists():
+            self.data.update(json.loads(self.path.read_text(encoding="utf-8")))
+
+    @staticmethod
+    def _api_key(deputado_id: int, ano: int) -> str:
+        return f"{deputado_id}/{ano}"
+
+    def get_api(self, deputado_id: int, ano: int) -> dict | None:
+        return self.data["api"].get(self._api_key(deputado_id, ano))
+
+    def set_api(self, deputado_id: int, ano: int, mes: int, hash_: str) -> None:
+        self.data["api"][self._api_key(deputado_id, ano)] = {"mes": mes, "hash": hash_}
+
+    def get_url(self, url: str) -> dict | None:
+        return self.data["url"].get(url)
+
+    def set_url(self, url: str, etag: str | None, last_modified: str | None, meses: dict[str, str]) -> None:
+        self.data["url"][url] = {"etag": etag, "last_modified": last_modified, "meses": meses}
+
+    def save(self) -> None:
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.data, indent=2), encoding="utf-8")
+        tmp_path.replace(self.path)
+        logger.info(f"Checkpoints saved to {self.path}")
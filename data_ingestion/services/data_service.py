@@ -1,111 +1,672 @@
-import io
-import json
-import re
-import zipfile
-
-import httpx
-from tqdm import tqdm
-
-from data_ingestion.services.log_service import logger
-
-
-class DataService:
-    def __init__(self) -> None:
-        self.api_base_url = "https://dadosabertos.camara.leg.br/api/v2"
-
-    def get_deputados(self) -> list:
-        response = httpx.get(f"{self.api_base_url}/deputados")
-        data = response.json().get("dados")
-        selected_data = [
-            {
-                "id": i["id"],
-                "nome": i["nome"],
-                "sigla_partido": i["siglaPartido"],
-                "id_legislatura": i["idLegislatura"],
-                "sigla_uf": i["siglaUf"],
-            }
-            for i in data
-        ]
-
-        return selected_data
-
-    def get_data_from_api(self, anos: list[int]) -> tuple[list[dict], list[dict], list[dict]]:
-        deputados = self.get_deputados()
-        despesas = []
-        fornecedores = []
-        for ano in anos:
-            logger.info(f"Getting data from API for year {ano}")
-            for deputado in tqdm(deputados):
-                response = httpx.get(f"{self.api_base_url}/deputados/{deputado['id']}/despesas?ano={ano}")
-                despesas_deputado = response.json().get("dados")
-
-                for item in despesas_deputado:
-                    despesas.append({
-                        "nome_deputado": deputado.get("nome"),
-                        "ano": item.get("ano"),
-                        "mes": item.get("mes"),
-                        "tipo_despesa": item.get("tipoDespesa"),
-                        "data_documento": item.get("dataDocumento"),
-                        "valor_documento": item.get("valorDocumento"),
-                        "cnpj_cpf_fornecedor": re.sub(r"[^0-9]", "", item.get("cnpjCpfFornecedor")),
-                        "valor_liquido": item.get("valorLiquido"),
-                        "valor_glosa": item.get("valorGlosa"),
-                        "fonte": "api",
-                    })
-
-                    fornecedores.append({
-                        "nome_fornecedor": item.get("nomeFornecedor"),
-                        "cnpj_cpf_fornecedor": re.sub(r"[^0-9]", "", item.get("cnpjCpfFornecedor")),
-                        "fonte": "api",
-                    })
-
-        logger.info(f"Total number of despesas: {len(despesas)}")
-
-        return deputados, despesas, fornecedores
-
-    @staticmethod
-    def get_data_from_url(url: str) -> tuple[list[dict], list[dict], list[dict]]:
-        logger.info(f"Getting data from url: {url}")
-        response = httpx.get(url=url)
-        zip_content = response.content
-
-        with zipfile.ZipFile(io.BytesIO(zip_content)) as zip_file:
-            with zip_file.open(zip_file.namelist()[0]) as json_file:
-                json_content = json_file.read().decode("utf-8")
-                json_data = json.loads(json_content).get("dados")
-
-        deputados = []
-        despesas = []
-        fornecedores = []
-
-        for item in json_data:
-            deputados.append({
-                "id": item["numeroDeputadoID"],
-                "nome": item["nomeParlamentar"],
-                "sigla_partido": item["siglaPartido"],
-                "id_legislatura": item["codigoLegislatura"],
-                "sigla_uf": item["siglaUF"],
-            })
-
-            despesas.append({
-                "nome_deputado": item.get("nomeParlamentar"),
-                "ano": item.get("ano"),
-                "mes": item.get("mes"),
-                "tipo_despesa": item.get("descricao"),
-                "data_documento": item.get("dataEmissao"),
-                "valor_documento": item.get("valorDocumento"),
-                "cnpj_cpf_fornecedor": re.sub(r"[^0-9]", "", item.get("cnpjCPF")),
-                "valor_liquido": item.get("valorLiquido"),
-                "valor_glosa": item.get("valorGlosa"),
-                "fonte": "url",
-            })
-
-            fornecedores.append({
-                "nome_fornecedor": item.get("fornecedor"),
-                "cnpj_cpf_fornecedor": re.sub(r"[^0-9]", "", item.get("cnpjCPF")),
-                "fonte": "url",
-            })
-
-        logger.info(f"Total number of despesas: {len(despesas)}")
-
-        return deputados, despesas, fornecedores
+import asyncio
+import hashlib
+import io
+import json
+import tempfile
+import time
+import zipfile
+from collections.abc import AsyncIterator, Iterator
+from contextlib import AsyncExitStack
+from typing import IO, Any
+
+import httpx
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from tqdm import tqdm
+
+from data_ingestion.services.cache_service import CacheEntry, ResponseCache
+from data_ingestion.services.checkpoint_service import CheckpointService, content_hash
+from data_ingestion.services.dead_letter_service import DeadLetterService
+from data_ingestion.services.fetch_service import AsyncFetcher
+from data_ingestion.services.log_service import logger
+from data_ingestion.utils.decorators import bounded_repr, metrics, stage, timed
+from data_ingestion.utils.json_stream import iter_json_array
+
+COTAS_URL = "https://www.camara.leg.br/cotas/Ano-{ano}.json.zip"
+BATCH_SIZE = 50_000
+SPOOL_MAX_SIZE = 32 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Raw field names of each source mapped to the despesas columns
+API_COLUMNS = {
+    "ano": "ano",
+    "mes": "mes",
+    "tipoDespesa": "tipo_despesa",
+    "dataDocumento": "data_documento",
+    "numDocumento": "num_documento",
+    "valorDocumento": "valor_documento",
+    "cnpjCpfFornecedor": "cnpj_cpf_fornecedor",
+    "valorLiquido": "valor_liquido",
+    "valorGlosa": "valor_glosa",
+    "nomeFornecedor": "nome_fornecedor",
+}
+URL_COLUMNS = {
+    "numeroDeputadoID": "deputado_id",
+    "nomeParlamentar": "nome_deputado",
+    "siglaPartido": "sigla_partido",
+    "codigoLegislatura": "id_legislatura",
+    "siglaUF": "sigla_uf",
+    "ano": "ano",
+    "mes": "mes",
+    "descricao": "tipo_despesa",
+    "dataEmissao": "data_documento",
+    "numero": "num_documento",
+    "valorDocumento": "valor_documento",
+    "cnpjCPF": "cnpj_cpf_fornecedor",
+    "valorLiquido": "valor_liquido",
+    "valorGlosa": "valor_glosa",
+    "fornecedor": "nome_fornecedor",
+}
+DEPUTADO_COLUMNS = {
+    "deputado_id": "id",
+    "nome_deputado": "nome",
+    "sigla_partido": "sigla_partido",
+    "id_legislatura": "id_legislatura",
+    "sigla_uf": "sigla_uf",
+}
+DESPESA_COLUMNS = [
+    "deputado_id",
+    "nome_deputado",
+    "ano",
+    "mes",
+    "tipo_despesa",
+    "data_documento",
+    "num_documento",
+    "valor_documento",
+    "cnpj_cpf_fornecedor",
+    "valor_liquido",
+    "valor_glosa",
+    "fonte",
+]
+FORNECEDOR_COLUMNS = ["nome_fornecedor", "cnpj_cpf_fornecedor", "fonte"]
+INTEGER_COLUMNS = ["deputado_id", "id_legislatura", "ano", "mes"]
+FLOAT_COLUMNS = ["valor_documento", "valor_liquido", "valor_glosa"]
+REQUIRED_COLUMNS = ["ano", "mes"]
+TEXT_COLUMNS = [
+    "nome_deputado",
+    "sigla_partido",
+    "sigla_uf",
+    "tipo_despesa",
+    "data_documento",
+    "num_documento",
+    "cnpj_cpf_fornecedor",
+    "nome_fornecedor",
+]
+# Length of the String(100) columns they are loaded into
+MAX_TEXT_LENGTH = 100
+ERROR_COLUMN = "erro"
+
+# Failures that only affect one request or one file, the rest of the run carries on without it
+REQUEST_ERRORS = (httpx.HTTPError, ValueError)
+FILE_ERRORS = (httpx.HTTPError, zipfile.BadZipFile, ValueError)
+
+Batch = tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]
+
+
+# Lengths are computed by Arrow, a column that mixes strings with other values falls back to pandas
+def _too_long(values: pd.Series, max_length: int = MAX_TEXT_LENGTH) -> np.ndarray:
+    try:
+        array = pa.array(values.to_numpy(), type=pa.string(), from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return np.array([isinstance(value, str) and len(value) > max_length for value in values], dtype=bool)
+    return pc.fill_null(pc.greater(pc.utf8_length(array), max_length), False).to_numpy(zero_copy_only=False)
+
+
+# Columns are built from the raw items as Python objects, so text fields reach the loader exactly as received.
+# Rows that would fail the load get a reason in ERROR_COLUMN instead of failing the whole batch.
+def items_frame(items: list[dict], columns: dict[str, str]) -> pd.DataFrame:
+    not_objects = [not isinstance(item, dict) for item in items]
+    if any(not_objects):
+        items = [{} if not_object else item for item, not_object in zip(items, not_objects, strict=True)]
+    frame = pd.DataFrame(items, columns=list(columns), dtype=object).rename(columns=columns)
+    checks = [(np.array(not_objects, dtype=bool), "item is not an object")]
+
+    for column in INTEGER_COLUMNS + FLOAT_COLUMNS:
+        if column in frame:
+            raw = frame[column]
+            values = pd.to_numeric(raw, errors="coerce")
+            invalid = values.isna() & raw.notna() & ~raw.isin([""])
+            if column in INTEGER_COLUMNS:
+                invalid |= values.notna() & (values % 1 != 0)
+            if invalid.any():
+                checks.append((invalid.to_numpy(), f"invalid {column}"))
+                values = values.mask(invalid)
+            if column in FLOAT_COLUMNS:
+                frame[column] = values.astype("float64")
+            else:
+                # Leadership entries in the annual files have deputado id 0, they are kept as despesas without deputado
+                values = values.astype("Int64")
+                frame[column] = values.mask(values == 0) if column == "deputado_id" else values
+    checks.extend((frame[column].isna().to_numpy(), f"missing {column}") for column in REQUIRED_COLUMNS)
+
+    with stage("normalise") as counters:
+        frame["cnpj_cpf_fornecedor"] = (
+            frame["cnpj_cpf_fornecedor"].fillna("").astype(str).str.replace(r"\D", "", regex=True)
+        )
+        counters["rows"] += len(frame)
+    checks.extend(
+        (_too_long(frame[column]), f"{column} longer than {MAX_TEXT_LENGTH}")
+        for column in TEXT_COLUMNS
+        if column in frame
+    )
+
+    # The first failed check of a row is the reason it is rejected for
+    errors = np.full(len(frame), None, dtype=object)
+    for mask, reason in reversed(checks):
+        errors[mask] = reason
+    frame[ERROR_COLUMN] = errors
+    return frame
+
+
+# Rejected rows go to the dead letters with their raw item, the rest of the batch is loaded as usual
+def drop_rejected(
+    frame: pd.DataFrame,
+    items: list,
+    dead_letters: DeadLetterService | None = None,
+    **context: str,
+) -> pd.DataFrame:
+    rejected = np.flatnonzero(frame[ERROR_COLUMN].notna().to_numpy())
+    if not len(rejected):
+        return frame.drop(columns=ERROR_COLUMN)
+
+    logger.warning(f"{len(rejected)} of {len(frame)} items rejected: {frame[ERROR_COLUMN].iloc[rejected[0]]}, ...")
+    if dead_letters is not None:
+        for position in rejected:
+            deputado_id = frame["deputado_id"].iloc[position]
+            dead_letters.add(
+                "item",
+                frame[ERROR_COLUMN].iloc[position],
+                item=items[position],
+                deputado_id=None if pd.isna(deputado_id) else int(deputado_id),
+                **context,
+            )
+    return frame.loc[frame[ERROR_COLUMN].isna()].drop(columns=ERROR_COLUMN)
+
+
+def deputados_frame(frame: pd.DataFrame) -> pd.DataFrame:
+    deputados = frame.loc[frame["deputado_id"].notna(), list(DEPUTADO_COLUMNS)].rename(columns=DEPUTADO_COLUMNS)
+    return deputados.drop_duplicates("id", keep="last").reset_index(drop=True)
+
+
+def split_frame(frame: pd.DataFrame, fonte: str) -> tuple[pd.DataFrame, pd.DataFrame]:
+    frame = frame.assign(fonte=fonte)
+    fornecedores = frame[FORNECEDOR_COLUMNS].drop_duplicates("cnpj_cpf_fornecedor", keep="last")
+    return frame.reindex(columns=DESPESA_COLUMNS).reset_index(drop=True), fornecedores.reset_index(drop=True)
+
+
+def concat_batches(batches: list[Batch]) -> Batch:
+    if not batches:
+        frame = items_frame([], URL_COLUMNS)
+        return deputados_frame(frame), *split_frame(frame, "url")
+    deputados, despesas, fornecedores = (pd.concat(frames, ignore_index=True) for frames in zip(*batches, strict=True))
+    return (
+        deputados.drop_duplicates("id", keep="last").reset_index(drop=True),
+        despesas,
+        fornecedores.drop_duplicates("cnpj_cpf_fornecedor", keep="last").reset_index(drop=True),
+    )
+
+
+def _from_cache(
+    cache: ResponseCache,
+    entry: CacheEntry,
+    file: IO[bytes],
+    etag: str | None,
+    last_modified: str | None,
+) -> dict | None:
+    if (etag and entry.etag == etag) or (last_modified and entry.last_modified == last_modified):
+        return None
+    cache.copy_to(entry, file)
+    return {"etag": entry.etag, "last_modified": entry.last_modified}
+
+
+def _request_url(error: Exception) -> str | None:
+    try:
+        return str(error.request.url)
+    except (AttributeError, RuntimeError):
+        return None
+
+
+def download_to_file(
+    url: str,
+    file: IO[bytes],
+    etag: str | None = None,
+    last_modified: str | None = None,
+    cache: ResponseCache | None = None,
+) -> dict | None:
+    entry = cache.get(url) if cache is not None else None
+    if entry is not None and cache.is_fresh(entry):
+        cache.hit(entry)
+        return _from_cache(cache, entry, file, etag, last_modified)
+
+    if entry is not None:
+        headers = cache.validators(entry)
+    else:
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+    with httpx.stream("GET", url, headers=headers, follow_redirects=True, timeout=60.0) as response:
+        if response.status_code == httpx.codes.NOT_MODIFIED:
+            if entry is None:
+                return None
+            cache.hit(entry, revalidated=True)
+            return _from_cache(cache, entry, file, etag, last_modified)
+        response.raise_for_status()
+        with stage("download") as counters:
+            for chunk in response.iter_bytes(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                file.write(chunk)
+                counters["bytes"] += len(chunk)
+            counters["requests"] += 1
+    file.seek(0)
+
+    if cache is not None:
+        cache.miss()
+        cache.store_file(url, None, file, dict(response.headers))
+
+    return {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+
+
+def iter_zip_items(file: IO[bytes]) -> Iterator[dict]:
+    file.seek(0)
+    with zipfile.ZipFile(file) as zip_file, zip_file.open(zip_file.namelist()[0]) as member:
+        yield from iter_json_array(io.TextIOWrapper(member, encoding="utf-8-sig"), "dados")
+
+
+# Year and month of a raw item, None for the items items_frame will reject, so the checkpoint code that looks at
+# items before it doesn't fail on them
+def item_month(item: Any) -> tuple[int, int] | None:
+    try:
+        return int(item["ano"]), int(item["mes"])
+    except (TypeError, KeyError, ValueError):
+        return None
+
+
+def hash_zip_months(file: IO[bytes]) -> dict[str, str]:
+    hashes = {}
+    for item in iter_zip_items(file):
+        # Items without a month belong to no month that could be replaced
+        if (month := item_month(item)) is None:
+            continue
+        key = "{}-{}".format(*month)
+        if key not in hashes:
+            hashes[key] = hashlib.sha256()
+        hashes[key].update(json.dumps(item, sort_keys=True).encode("utf-8"))
+
+    return {key: hash_.hexdigest() for key, hash_ in hashes.items()}
+
+
+class DataService:
+    def __init__(
+        self,
+        api_base_url: str = "https://dadosabertos.camara.leg.br/api/v2",
+        max_concurrency: int = 10,
+        rate_limit: float = 20.0,
+        max_retries: int = 5,
+        cache: ResponseCache | None = None,
+        dead_letters: DeadLetterService | None = None,
+    ) -> None:
+        self.api_base_url = api_base_url
+        self.max_concurrency = max_concurrency
+        self.rate_limit = rate_limit
+        self.max_retries = max_retries
+        self.cache = cache
+        self.dead_letters = dead_letters
+
+    def _fetcher(self) -> AsyncFetcher:
+        return AsyncFetcher(
+            max_concurrency=self.max_concurrency,
+            rate_limit=self.rate_limit,
+            max_retries=self.max_retries,
+            cache=self.cache,
+        )
+
+    async def _get_deputados(self, fetcher: AsyncFetcher) -> list:
+        data, _ = await fetcher.get_all_pages(f"{self.api_base_url}/deputados")
+        selected_data = [
+            {
+                "id": i["id"],
+                "nome": i["nome"],
+                "sigla_partido": i["siglaPartido"],
+                "id_legislatura": i["idLegislatura"],
+                "sigla_uf": i["siglaUf"],
+            }
+            for i in data
+        ]
+
+        return selected_data
+
+    def get_deputados(self) -> list:
+        async def run() -> list:
+            async with self._fetcher() as fetcher:
+                return await self._get_deputados(fetcher)
+
+        return asyncio.run(run())
+
+    async def _get_despesas_deputado(
+        self,
+        fetcher: AsyncFetcher,
+        deputado: dict,
+        ano: int,
+        mes_inicio: int = 1,
+    ) -> tuple[list[dict], int]:
+        params = {"ano": ano}
+        if mes_inicio > 1:
+            params["mes"] = list(range(mes_inicio, 13))
+        return await fetcher.get_all_pages(f"{self.api_base_url}/deputados/{deputado['id']}/despesas", params)
+
+    @timed("api_fetch", rows=lambda results: sum(len(result[0]) for result in results if result is not None))
+    async def _get_despesas_ano(
+        self,
+        fetcher: AsyncFetcher,
+        deputados: list[dict],
+        ano: int,
+        mes_inicios: dict[int, int],
+    ) -> list[tuple[list[dict], int] | None]:
+        start = time.perf_counter()
+        with tqdm(total=len(deputados)) as progress:
+
+            async def fetch(deputado: dict) -> tuple[list[dict], int] | None:
+                mes_inicio = mes_inicios.get(deputado["id"], 1)
+                try:
+                    result = await self._get_despesas_deputado(fetcher, deputado, ano, mes_inicio)
+                except REQUEST_ERRORS as e:
+                    if self.dead_letters is None:
+                        raise
+                    # Only this deputado is left out of the year, --retry-dead-letters fetches it again
+                    logger.warning(f"Despesas of deputado {deputado['id']} in {ano} failed: {bounded_repr(e)}")
+                    self.dead_letters.add(
+                        "deputado", e, ano=ano, deputado_id=deputado["id"], mes_inicio=mes_inicio, url=_request_url(e)
+                    )
+                    result = None
+                progress.update(1)
+                return result
+
+            results = await asyncio.gather(*(fetch(deputado) for deputado in deputados))
+
+        elapsed = time.perf_counter() - start
+        fetched = [result for result in results if result is not None]
+        total_records = sum(len(items) for items, _ in fetched)
+        total_pages = sum(pages for _, pages in fetched)
+        logger.info(
+            f"Year {ano}: {total_records} records in {elapsed:.1f}s "
+            f"({total_records / elapsed:.0f} records/s, "
+            f"{total_pages / max(len(fetched), 1):.1f} pages per deputado)"
+        )
+        if len(fetched) < len(deputados):
+            logger.warning(f"Year {ano}: {len(deputados) - len(fetched)} deputados failed and were left out")
+
+        return results
+
+    @staticmethod
+    def _update_api_checkpoint(
+        checkpoints: CheckpointService,
+        deputado: dict,
+        ano: int,
+        despesas_deputado: list[dict],
+    ) -> dict | None:
+        checkpoint = checkpoints.get_api(deputado["id"], ano)
+        if checkpoint and checkpoint["hash"] == content_hash(despesas_deputado):
+            return None
+
+        # The last month seen may still receive documents, so the next run starts from it again
+        mes_inicio = checkpoint["mes"] if checkpoint else 1
+        months = [(item, month[1]) for item in despesas_deputado if (month := item_month(item)) is not None]
+        mes = max((month for _, month in months), default=mes_inicio)
+        window = [item for item, month in months if month >= mes]
+        checkpoints.set_api(deputado["id"], ano, mes, content_hash(window))
+
+        return {"fonte": "api", "ano": ano, "meses": list(range(mes_inicio, 13)), "deputado_id": deputado["id"]}
+
+    @staticmethod
+    @timed("transform", rows=lambda batch: len(batch[1]))
+    def _api_batch(
+        deputados: list[dict],
+        owners: list[tuple[dict, list[dict]]],
+        dead_letters: DeadLetterService | None = None,
+    ) -> Batch:
+        items = [item for _, despesas_deputado in owners for item in despesas_deputado]
+        counts = [len(despesas_deputado) for _, despesas_deputado in owners]
+        frame = items_frame(items, API_COLUMNS)
+        frame["deputado_id"] = pd.array(np.repeat([d["id"] for d, _ in owners], counts), dtype="Int64")
+        frame["nome_deputado"] = np.repeat(np.array([d["nome"] for d, _ in owners], dtype=object), counts)
+        frame = drop_rejected(frame, items, dead_letters, fonte="api")
+
+        deputados_df = pd.DataFrame(deputados, columns=list(DEPUTADO_COLUMNS.values()))
+        deputados_df = deputados_df.astype({"id": "Int64", "id_legislatura": "Int64"})
+        return deputados_df, *split_frame(frame, "api")
+
+    # With `failed`, a map of year to deputado id to first month, only those deputados are fetched again
+    @staticmethod
+    def _select_deputados(
+        deputados: list[dict],
+        ano: int,
+        checkpoints: CheckpointService | None = None,
+        failed: dict[int, dict[int, int]] | None = None,
+    ) -> tuple[list[dict], dict[int, int]]:
+        if failed is not None:
+            mes_inicios = failed.get(ano, {})
+            return [deputado for deputado in deputados if deputado["id"] in mes_inicios], mes_inicios
+
+        mes_inicios = {}
+        if checkpoints is not None:
+            for deputado in deputados:
+                if checkpoint := checkpoints.get_api(deputado["id"], ano):
+                    mes_inicios[deputado["id"]] = checkpoint["mes"]
+        return deputados, mes_inicios
+
+    # One batch per year, so the year being fetched overlaps with the loading of the previous one
+    async def _iter_data_from_api(
+        self,
+        fetcher: AsyncFetcher,
+        anos: list[int],
+        checkpoints: CheckpointService | None = None,
+        failed: dict[int, dict[int, int]] | None = None,
+    ) -> AsyncIterator[tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, list[dict]]]:
+        deputados = await self._get_deputados(fetcher)
+        for ano in anos:
+            logger.info(f"Getting data from API for year {ano}")
+            selected, mes_inicios = self._select_deputados(deputados, ano, checkpoints, failed)
+            results = await self._get_despesas_ano(fetcher, selected, ano, mes_inicios)
+
+            owners = []
+            replace = []
+            for deputado, result in zip(selected, results, strict=True):
+                # A failed deputado keeps its checkpoint, so the next incremental run covers it again
+                if result is None:
+                    continue
+                despesas_deputado, _ = result
+                if checkpoints is not None:
+                    scope = self._update_api_checkpoint(checkpoints, deputado, ano, despesas_deputado)
+                    if scope is None:
+                        continue
+                    replace.append(scope)
+                owners.append((deputado, despesas_deputado))
+
+            deputados_df, despesas, fornecedores = self._api_batch(deputados, owners, self.dead_letters)
+            if checkpoints is not None:
+                logger.info(f"{len(replace)} deputados have new or changed despesas in {ano}")
+            logger.info(f"Number of despesas in {ano}: {len(despesas)}")
+            yield deputados_df, despesas, fornecedores, replace
+
+    # The event loop only runs while the next batch is requested, so the caller's pace sets the fetch pace
+    def _stream_api(
+        self,
+        anos: list[int],
+        checkpoints: CheckpointService | None = None,
+        failed: dict[int, dict[int, int]] | None = None,
+    ) -> Iterator[tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, list[dict]]]:
+        loop = asyncio.new_event_loop()
+        stack = AsyncExitStack()
+        try:
+            fetcher = loop.run_until_complete(stack.enter_async_context(self._fetcher()))
+            batches = self._iter_data_from_api(fetcher, anos, checkpoints, failed)
+            while True:
+                try:
+                    yield loop.run_until_complete(anext(batches))
+                except StopAsyncIteration:
+                    break
+            logger.info(f"{fetcher.request_count} requests made to the API")
+        finally:
+            loop.run_until_complete(stack.aclose())
+            loop.close()
+
+    def stream_data_from_api(self, anos: list[int]) -> Iterator[Batch]:
+        for deputados, despesas, fornecedores, _ in self._stream_api(anos):
+            yield deputados, despesas, fornecedores
+
+    def stream_new_data_from_api(
+        self,
+        anos: list[int],
+        checkpoints: CheckpointService,
+    ) -> Iterator[tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, list[dict]]]:
+        yield from self._stream_api(anos, checkpoints)
+
+    def stream_failed_from_api(self, failed: dict[int, dict[int, int]]) -> Iterator[Batch]:
+        for deputados, despesas, fornecedores, _ in self._stream_api(sorted(failed), failed=failed):
+            yield deputados, despesas, fornecedores
+
+    def get_data_from_api(self, anos: list[int]) -> Batch:
+        return concat_batches(list(self.stream_data_from_api(anos)))
+
+    def get_new_data_from_api(
+        self,
+        anos: list[int],
+        checkpoints: CheckpointService,
+    ) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, list[dict]]:
+        batches = list(self.stream_new_data_from_api(anos, checkpoints))
+        replace = [scope for *_, scopes in batches for scope in scopes]
+        return *concat_batches([batch[:3] for batch in batches]), replace
+
+    @staticmethod
+    @timed("transform", rows=lambda batch: len(batch[1]))
+    def _transform_zip_batch(
+        items: list[dict], dead_letters: DeadLetterService | None = None, url: str | None = None
+    ) -> Batch:
+        frame = drop_rejected(items_frame(items, URL_COLUMNS), items, dead_letters, url=url)
+        return deputados_frame(frame), *split_frame(frame, "url")
+
+    @staticmethod
+    def _read_zip(
+        file: IO[bytes],
+        batch_size: int = BATCH_SIZE,
+        meses: set[str] | None = None,
+        dead_letters: DeadLetterService | None = None,
+        url: str | None = None,
+    ) -> Iterator[Batch]:
+        items = []
+        total = 0
+
+        # Parsing is timed per batch, leaving out the transform and whatever the consumer does with the batch
+        start = time.perf_counter()
+        for item in iter_zip_items(file):
+            # Items without a month are kept, so items_frame rejects them into the dead letters
+            month = item_month(item)
+            if meses is not None and month is not None and "{}-{}".format(*month) not in meses:
+                continue
+
+            items.append(item)
+            if len(items) >= batch_size:
+                metrics.record("parse", time.perf_counter() - start, rows=len(items))
+                total += len(items)
+                yield DataService._transform_zip_batch(items, dead_letters, url)
+                items = []
+                start = time.perf_counter()
+
+        if items:
+            metrics.record("parse", time.perf_counter() - start, rows=len(items))
+            total += len(items)
+            yield DataService._transform_zip_batch(items, dead_letters, url)
+
+        logger.info(f"Total number of despesas: {total}")
+
+    @staticmethod
+    def _url_failed(dead_letters: DeadLetterService | None, url: str, error: Exception) -> None:
+        if dead_letters is None:
+            raise error
+        # Batches already yielded are kept, the retry loads the whole file again over them
+        logger.warning(f"Data from url {url} failed: {bounded_repr(error)}")
+        dead_letters.add("url", error, url=url)
+
+    @staticmethod
+    def stream_data_from_url(
+        url: str,
+        batch_size: int = BATCH_SIZE,
+        cache: ResponseCache | None = None,
+        dead_letters: DeadLetterService | None = None,
+    ) -> Iterator[Batch]:
+        logger.info(f"Getting data from url: {url}")
+
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as tmp_file:
+            try:
+                download_to_file(url=url, file=tmp_file, cache=cache)
+                yield from DataService._read_zip(tmp_file, batch_size, dead_letters=dead_letters, url=url)
+            except FILE_ERRORS as e:
+                DataService._url_failed(dead_letters, url, e)
+
+    @staticmethod
+    def stream_new_data_from_url(
+        url: str,
+        checkpoints: CheckpointService,
+        batch_size: int = BATCH_SIZE,
+        cache: ResponseCache | None = None,
+        dead_letters: DeadLetterService | None = None,
+    ) -> Iterator[tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, list[dict]]]:
+        logger.info(f"Getting new data from url: {url}")
+        try:
+            yield from DataService._iter_new_data_from_url(url, checkpoints, batch_size, cache, dead_letters)
+        except FILE_ERRORS as e:
+            # The checkpoint of the url is only set after its last batch, so it is fetched again next run
+            DataService._url_failed(dead_letters, url, e)
+
+    @staticmethod
+    def _iter_new_data_from_url(
+        url: str,
+        checkpoints: CheckpointService,
+        batch_size: int,
+        cache: ResponseCache | None,
+        dead_letters: DeadLetterService | None,
+    ) -> Iterator[tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, list[dict]]]:
+        checkpoint = checkpoints.get_url(url) or {}
+
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as tmp_file:
+            validators = download_to_file(
+                url=url,
+                file=tmp_file,
+                etag=checkpoint.get("etag"),
+                last_modified=checkpoint.get("last_modified"),
+                cache=cache,
+            )
+            if validators is None:
+                logger.info(f"{url} not modified since last run")
+                return
+
+            hashes = hash_zip_months(tmp_file)
+            previous_hashes = checkpoint.get("meses", {})
+            meses = {key for key, hash_ in hashes.items() if previous_hashes.get(key) != hash_}
+            removed = set(previous_hashes) - set(hashes)
+            logger.info(f"{len(meses)} of {len(hashes)} months changed in {url}")
+
+            replace = []
+            for key in sorted(meses | removed):
+                ano, mes = key.split("-")
+                replace.append({"fonte": "url", "ano": int(ano), "meses": [int(mes)]})
+
+            for deputados, despesas, fornecedores in DataService._read_zip(
+                tmp_file, batch_size, meses, dead_letters, url
+            ):
+                yield deputados, despesas, fornecedores, replace
+                replace = []
+
+            if replace:
+                # Nothing was yielded, but months that disappeared from the file still need their rows removed
+                yield (*DataService._transform_zip_batch([], dead_letters, url), replace)
+
+        checkpoints.set_url(url, etag=validators["etag"], last_modified=validators["last_modified"], meses=hashes)
+
+    @staticmethod
+    def get_data_from_url(url: str, cache: ResponseCache | None = None) -> Batch:
+        return concat_batches(list(DataService.stream_data_from_url(url=url, cache=cache)))
@@ -1,19 +1,64 @@
-from sqlalchemy import Column, Float, Integer, String, create_engine, insert
+import hashlib
+import tempfile
+import time
+from typing import Any
+
+import pandas as pd
+from sqlalchemy import (
+    Column,
+    Connection,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    delete,
+    func,
+    insert,
+    inspect,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.schema import CreateTable
 
+from data_ingestion.services.engine_service import SQLITE_PATH, get_engine, mysql_url
 from data_ingestion.services.log_service import logger
+from data_ingestion.utils.decorators import stage, timed
 
 Base = declarative_base()
 
 
+# chave is the natural key built by despesa_key; rows loaded before it existed keep a NULL chave, which the unique
+# index never matches, until --migrate fills it in
 class Despesas(Base):
     __tablename__ = "despesas"
+    __table_args__ = (
+        Index("ux_despesas_chave", "chave", unique=True),
+        Index("ix_despesas_ano_mes", "ano", "mes"),
+        Index("ix_despesas_tipo_despesa", "tipo_despesa"),
+        Index("ix_despesas_deputado_id", "deputado_id"),
+        Index("ix_despesas_fornecedor_id", "fornecedor_id"),
+        Index("ix_despesas_valor_documento", "valor_documento"),
+        Index("ix_despesas_nome_deputado", "nome_deputado"),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True)
+    chave = Column(String(64))
+    deputado_id = Column(Integer, ForeignKey("deputados.id"))
+    fornecedor_id = Column(Integer, ForeignKey("fornecedores.id"))
     nome_deputado = Column(String(100))
     ano = Column(Integer)
     mes = Column(Integer)
     tipo_despesa = Column(String(100))
     data_documento = Column(String(100))
+    num_documento = Column(String(100))
     valor_documento = Column(Float)
     cnpj_cpf_fornecedor = Column(String(100))
     valor_liquido = Column(Float)
@@ -23,6 +68,7 @@ class Despesas(Base):
 
 class Fornecedores(Base):
     __tablename__ = "fornecedores"
+    __table_args__ = (Index("ft_fornecedores_nome_fornecedor", "nome_fornecedor", mysql_prefix="FULLTEXT"),)
     id = Column(Integer, primary_key=True, autoincrement=True)
     nome_fornecedor = Column(String(100))
     cnpj_cpf_fornecedor = Column(String(100), unique=True)
@@ -31,13 +77,103 @@ class Fornecedores(Base):
 
 class Deputados(Base):
     __tablename__ = "deputados"
+    __table_args__ = (Index("ft_deputados_nome", "nome", mysql_prefix="FULLTEXT"),)
     id = Column(Integer, primary_key=True)
-    nome = Column(String(100), unique=True)
+    nome = Column(String(100))
     sigla_partido = Column(String(100))
     id_legislatura = Column(Integer)
     sigla_uf = Column(String(100))
 
 
+class DespesasAgregadas(Base):
+    __tablename__ = "despesas_agregadas"
+    __table_args__ = (Index("ix_despesas_agregadas_ano_mes", "ano", "mes"),)
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    ano = Column(Integer)
+    mes = Column(Integer)
+    deputado_id = Column(Integer)
+    nome_deputado = Column(String(100))
+    sigla_partido = Column(String(100))
+    sigla_uf = Column(String(100))
+    tipo_despesa = Column(String(100))
+    fornecedor_id = Column(Integer)
+    total = Column(Float)
+    quantidade = Column(Integer)
+    # Every row, quantidade only counts those with a valor_documento
+    linhas = Column(Integer)
+    minimo = Column(Float)
+    maximo = Column(Float)
+
+
+# Scores written by AnomalyService; the lower the score the more isolated the expense, negative means flagged
+class DespesasAnomalias(Base):
+    __tablename__ = "despesas_anomalias"
+    __table_args__ = (Index("ix_despesas_anomalias_anomalia_score", "anomalia", "score"),)
+    despesa_id = Column(Integer, primary_key=True, autoincrement=False)
+    score = Column(Float, nullable=False)
+    anomalia = Column(Integer, nullable=False)
+    modelo_versao = Column(Integer, nullable=False)
+
+
+# Single row bumped after every load, so readers such as the dashboard can tell when their caches are stale
+class UltimaCarga(Base):
+    __tablename__ = "ultima_carga"
+    id = Column(Integer, primary_key=True)
+    versao = Column(Integer, nullable=False)
+    concluida_em = Column(DateTime, nullable=False)
+
+
+CHUNK_SIZE = 10_000
+LOOKUP_SIZE = 1_000
+UPSERT_KEYS = {
+    "deputados": ["id"],
+    "fornecedores": ["cnpj_cpf_fornecedor"],
+    "despesas": ["chave"],
+    "despesas_anomalias": ["despesa_id"],
+}
+# ER_NOT_ALLOWED_COMMAND and ER_CLIENT_LOCAL_FILES_DISABLED, LOCAL INFILE is turned off on the server or the client
+LOCAL_INFILE_ERRORS = {1148, 3948}
+
+
+def despesa_key(despesa: dict) -> str:
+    valor = despesa.get("valor_documento")
+    parts = (
+        despesa.get("nome_deputado"),
+        (despesa.get("data_documento") or "")[:10],
+        despesa.get("cnpj_cpf_fornecedor"),
+        f"{float(valor):.2f}" if valor is not None else None,
+        despesa.get("tipo_despesa"),
+        despesa.get("num_documento"),
+    )
+    return hashlib.sha256("|".join("" if part is None else str(part) for part in parts).encode("utf-8")).hexdigest()
+
+
+# Same key as despesa_key, built column by column for a whole batch
+def despesa_keys(despesas: pd.DataFrame) -> pd.Series:
+    valor = despesas["valor_documento"].map(lambda value: f"{float(value):.2f}", na_action="ignore")
+    parts = [
+        despesas["nome_deputado"],
+        despesas["data_documento"].fillna("").astype(str).str[:10],
+        despesas["cnpj_cpf_fornecedor"],
+        valor,
+        despesas["tipo_despesa"],
+        despesas["num_documento"],
+    ]
+    parts = [part.astype(object).where(part.notna(), "").astype(str) for part in parts]
+    joined = parts[0].str.cat(parts[1:], sep="|")
+    return joined.map(lambda key: hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+
+def to_records(frame: pd.DataFrame) -> list[dict]:
+    return frame.astype(object).where(frame.notna(), None).to_dict("records")
+
+
+def mysql_field(value: Any) -> str:
+    if value is None:
+        return "\\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+
 class DBService:
     def __init__(
         self,
@@ -47,48 +183,432 @@ class DBService:
         host: str | None = None,
         port: int | None = None,
         dbname: str | None = None,
+        chunk_size: int = CHUNK_SIZE,
+        load_data_infile: bool = True,
     ) -> None:
         if local:
-            self.engine = create_engine("sqlite:///database.db")
+            self.engine = get_engine(f"sqlite:///{SQLITE_PATH}")
             self.dialect = "sqlite"
         else:
-            self.engine = create_engine(f"mysql+pymysql://{user}:{password}@{host}:{port}/{dbname}", pool_recycle=3600)
+            self.engine = get_engine(
+                mysql_url(user=user, password=password, host=host, port=port, dbname=dbname),
+                local_infile=load_data_infile,
+            )
             self.dialect = "mysql"
 
         self.Session = sessionmaker(bind=self.engine)
+        self.chunk_size = chunk_size
+        self.load_data_infile = load_data_infile and self.dialect == "mysql"
+        self.schema_created = False
+        self.rollups_stale = False
+        self.dirty_partitions: set[tuple[int, int]] = set()
+
+    def create_schema(self) -> None:
+        if self.schema_created:
+            return
 
-    def insert_data(self, deputados: list, despesas: list, fornecedores: list) -> None:
         Base.metadata.create_all(self.engine)
-        session = self.Session()
-
-        try:
-            logger.info("Inserindo deputados")
-            if deputados:
-                stmt = insert(Deputados)
-                if self.dialect == "sqlite":
-                    stmt = stmt.prefix_with("OR IGNORE")
-                elif self.dialect == "mysql":
-                    stmt = stmt.prefix_with("IGNORE")
-                session.execute(stmt, deputados)
-
-            logger.info("Inserindo fornecedores")
-            if fornecedores:
-                stmt = insert(Fornecedores)
-                if self.dialect == "sqlite":
-                    stmt = stmt.prefix_with("OR IGNORE")
-                elif self.dialect == "mysql":
-                    stmt = stmt.prefix_with("IGNORE")
-                session.execute(stmt, fornecedores)
-
-            logger.info("Inserindo despesas")
-            if despesas:
-                stmt = insert(Despesas)
-                if self.dialect == "sqlite":
-                    stmt = stmt.prefix_with("OR IGNORE")
-                elif self.dialect == "mysql":
-                    stmt = stmt.prefix_with("IGNORE")
-                session.execute(stmt, despesas)
-
-            session.commit()
-        finally:
-            session.close()
+
+        # create_all skips existing tables, so columns and indexes added to the models later are created here
+        inspector = inspect(self.engine)
+        with self.engine.begin() as connection:
+            for table in Base.metadata.sorted_tables:
+                columns = {column["name"] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name not in columns:
+                        logger.info(f"Adicionando coluna {table.name}.{column.name}")
+                        # The rollup rows already written have no value for the new column
+                        self.rollups_stale |= table is DespesasAgregadas.__table__
+                        column_type = column.type.compile(dialect=self.engine.dialect)
+                        connection.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+
+                indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+                for index in table.indexes:
+                    if index.name not in indexes:
+                        logger.info(f"Criando índice {index.name}")
+                        index.create(connection)
+
+        self.schema_created = True
+
+    @staticmethod
+    def _replace_despesas(connection: Connection, replace: list[dict]) -> None:
+        for scope in replace:
+            stmt = delete(Despesas).where(Despesas.fonte == scope["fonte"], Despesas.ano == scope["ano"])
+            if scope.get("meses"):
+                stmt = stmt.where(Despesas.mes.in_(scope["meses"]))
+            if scope.get("deputado_id"):
+                stmt = stmt.where(Despesas.deputado_id == scope["deputado_id"])
+            connection.execute(stmt)
+
+    def _upsert(self, connection: Connection, model: type[Base], rows: list[dict]) -> None:
+        keys = UPSERT_KEYS[model.__tablename__]
+        columns = [column for column in rows[0] if column not in keys]
+        if self.dialect == "sqlite":
+            stmt = sqlite_insert(model)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=keys,
+                set_={column: stmt.excluded[column] for column in columns},
+            )
+        else:
+            stmt = mysql_insert(model)
+            stmt = stmt.on_duplicate_key_update({column: stmt.inserted[column] for column in columns})
+        connection.execute(stmt, rows)
+
+    # Built from the columns alone, InnoDB refuses the FULLTEXT indexes that CREATE TABLE ... LIKE would copy
+    @staticmethod
+    def _staging_table(model: type[Base]) -> Table:
+        columns = [
+            Column(column.name, column.type, primary_key=column.primary_key, autoincrement=column.autoincrement)
+            for column in model.__table__.columns
+        ]
+        return Table(f"staging_{model.__tablename__}", MetaData(), *columns, prefixes=["TEMPORARY"])
+
+    @staticmethod
+    def _load_data_infile(connection: Connection, model: type[Base], rows: list[dict]) -> None:
+        table = model.__tablename__
+        staging = f"staging_{table}"
+        columns = list(rows[0])
+        updates = ", ".join(f"{column} = {staging}.{column}" for column in columns if column not in UPSERT_KEYS[table])
+
+        # LOAD DATA cannot upsert, so the chunk goes through a temporary staging table first
+        connection.execute(CreateTable(DBService._staging_table(model), if_not_exists=True))
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", suffix=".tsv", newline="") as tmp_file:
+            for row in rows:
+                tmp_file.write("\t".join(mysql_field(row.get(column)) for column in columns) + "\n")
+            tmp_file.flush()
+            connection.exec_driver_sql(
+                f"LOAD DATA LOCAL INFILE '{tmp_file.name}' IGNORE INTO TABLE {staging} "
+                "CHARACTER SET utf8mb4 FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' "
+                f"({', '.join(columns)})"
+            )
+        connection.exec_driver_sql(
+            f"INSERT INTO {table} ({', '.join(columns)}) SELECT {', '.join(columns)} FROM {staging} "
+            f"ON DUPLICATE KEY UPDATE {updates}"
+        )
+        connection.exec_driver_sql(f"DELETE FROM {staging}")
+
+    def _load_chunk(self, connection: Connection, model: type[Base], rows: list[dict]) -> None:
+        if self.load_data_infile:
+            try:
+                with connection.begin_nested():
+                    self._load_data_infile(connection, model, rows)
+            except OperationalError as e:
+                if e.orig.args[0] not in LOCAL_INFILE_ERRORS:
+                    raise
+                logger.warning(f"LOAD DATA LOCAL INFILE indisponível ({e.orig}), usando executemany")
+                self.load_data_infile = False
+            else:
+                return
+        self._upsert(connection, model, rows)
+
+    def _load_table(self, model: type[Base], frame: pd.DataFrame, connection: Connection | None = None) -> None:
+        logger.info(f"Inserindo {model.__tablename__}")
+        if frame.empty:
+            return
+
+        start = time.perf_counter()
+        with stage(f"load_{model.__tablename__}") as counters:
+            rows = to_records(frame)
+            if connection is not None:
+                # SQLite: a single executemany inside the caller's transaction
+                self._upsert(connection, model, rows)
+            else:
+                for offset in range(0, len(rows), self.chunk_size):
+                    with self.engine.begin() as chunk_connection:
+                        self._load_chunk(chunk_connection, model, rows[offset : offset + self.chunk_size])
+            counters["rows"] += len(rows)
+
+        elapsed = time.perf_counter() - start
+        rate = len(rows) / max(elapsed, 1e-9)
+        logger.info(f"{model.__tablename__}: {len(rows)} linhas em {elapsed:.2f}s ({rate:.0f} linhas/s)")
+
+    @staticmethod
+    def _resolve_fornecedor_ids(connection: Connection, despesas: pd.DataFrame) -> pd.Series:
+        cnpjs = despesas["cnpj_cpf_fornecedor"].unique().tolist()
+        ids = {}
+        for offset in range(0, len(cnpjs), LOOKUP_SIZE):
+            stmt = select(Fornecedores.cnpj_cpf_fornecedor, Fornecedores.id).where(
+                Fornecedores.cnpj_cpf_fornecedor.in_(cnpjs[offset : offset + LOOKUP_SIZE])
+            )
+            ids.update(connection.execute(stmt).all())
+
+        return despesas["cnpj_cpf_fornecedor"].map(ids).astype("Int64")
+
+    # Rows loaded before num_documento was read got their chave from --migrate without it, so a reload would not
+    # find them. The first matching row takes over the legacy row, which is then updated in place by the upsert.
+    @staticmethod
+    def _claim_legacy_despesas(connection: Connection, despesas: pd.DataFrame) -> None:
+        despesas = despesas[despesas["num_documento"].fillna("").astype(str) != ""]
+        if despesas.empty:
+            return
+
+        legacy_keys = despesa_keys(despesas.assign(num_documento=None))
+        claims = dict(
+            zip(legacy_keys.tolist(), despesas[["chave", "num_documento"]].itertuples(index=False), strict=True)
+        )
+        keys = list(claims)
+        legacy = {}
+        for offset in range(0, len(keys), LOOKUP_SIZE):
+            stmt = select(Despesas.chave, Despesas.id).where(
+                Despesas.chave.in_(keys[offset : offset + LOOKUP_SIZE]), Despesas.num_documento.is_(None)
+            )
+            legacy.update(connection.execute(stmt).all())
+        if not legacy:
+            return
+
+        chaves = [claims[key].chave for key in legacy]
+        existing = set()
+        for offset in range(0, len(chaves), LOOKUP_SIZE):
+            existing.update(
+                connection.execute(
+                    select(Despesas.chave).where(Despesas.chave.in_(chaves[offset : offset + LOOKUP_SIZE]))
+                ).scalars()
+            )
+
+        duplicates = [row_id for key, row_id in legacy.items() if claims[key].chave in existing]
+        updates = [
+            {"row_id": row_id, "chave": claims[key].chave, "num_documento": claims[key].num_documento}
+            for key, row_id in legacy.items()
+            if claims[key].chave not in existing
+        ]
+        if duplicates:
+            connection.execute(delete(Despesas).where(Despesas.id.in_(duplicates)))
+        if updates:
+            connection.execute(
+                text("UPDATE despesas SET chave = :chave, num_documento = :num_documento WHERE id = :row_id"), updates
+            )
+        logger.info(f"Despesas antigas atualizadas: {len(updates)}, substituídas: {len(duplicates)}")
+
+    @staticmethod
+    def _mark_loaded(connection: Connection) -> None:
+        stmt = (
+            update(UltimaCarga)
+            .where(UltimaCarga.id == 1)
+            .values(versao=UltimaCarga.versao + 1, concluida_em=func.now())
+        )
+        if connection.execute(stmt).rowcount == 0:
+            connection.execute(insert(UltimaCarga).values(id=1, versao=1, concluida_em=func.now()))
+
+    def upsert_frame(self, model: type[Base], frame: pd.DataFrame) -> None:
+        self.create_schema()
+        self._load_table(model, frame)
+
+    def mark_loaded(self) -> None:
+        self.create_schema()
+        with self.engine.begin() as connection:
+            self._mark_loaded(connection)
+
+    # Batches come from DataService already typed and deduplicated, one frame per table
+    @timed("insert_data")
+    def insert_data(
+        self,
+        deputados: pd.DataFrame,
+        despesas: pd.DataFrame,
+        fornecedores: pd.DataFrame,
+        replace: list | None = None,
+    ) -> None:
+        self.create_schema()
+
+        despesas = despesas.assign(chave=despesa_keys(despesas))
+        partitions = despesas[["ano", "mes"]].drop_duplicates()
+        self.dirty_partitions.update((int(ano), int(mes)) for ano, mes in partitions.itertuples(index=False))
+        for scope in replace or []:
+            self.dirty_partitions.update((scope["ano"], mes) for mes in scope.get("meses") or range(1, 13))
+
+        if self.dialect == "sqlite":
+            with self.engine.begin() as connection:
+                if replace:
+                    logger.info(f"Removendo despesas de {len(replace)} recortes alterados")
+                    self._replace_despesas(connection, replace)
+                self._load_table(Deputados, deputados, connection)
+                self._load_table(Fornecedores, fornecedores, connection)
+                despesas["fornecedor_id"] = self._resolve_fornecedor_ids(connection, despesas)
+                self._claim_legacy_despesas(connection, despesas)
+                self._load_table(Despesas, despesas, connection)
+                self._mark_loaded(connection)
+            return
+
+        if replace:
+            logger.info(f"Removendo despesas de {len(replace)} recortes alterados")
+            with self.engine.begin() as connection:
+                self._replace_despesas(connection, replace)
+        self._load_table(Deputados, deputados)
+        self._load_table(Fornecedores, fornecedores)
+        with self.engine.begin() as connection:
+            despesas["fornecedor_id"] = self._resolve_fornecedor_ids(connection, despesas)
+            self._claim_legacy_despesas(connection, despesas)
+        self._load_table(Despesas, despesas)
+        self.mark_loaded()
+
+    @staticmethod
+    def _rollup_select() -> Any:
+        return (
+            select(
+                Despesas.ano,
+                Despesas.mes,
+                Despesas.deputado_id,
+                Despesas.nome_deputado,
+                Deputados.sigla_partido,
+                Deputados.sigla_uf,
+                Despesas.tipo_despesa,
+                Despesas.fornecedor_id,
+                func.sum(Despesas.valor_documento),
+                func.count(Despesas.valor_documento),
+                func.count(),
+                func.min(Despesas.valor_documento),
+                func.max(Despesas.valor_documento),
+            )
+            .select_from(Despesas)
+            .outerjoin(Deputados, Despesas.deputado_id == Deputados.id)
+            .group_by(
+                Despesas.ano,
+                Despesas.mes,
+                Despesas.deputado_id,
+                Despesas.nome_deputado,
+                Deputados.sigla_partido,
+                Deputados.sigla_uf,
+                Despesas.tipo_despesa,
+                Despesas.fornecedor_id,
+            )
+        )
+
+    def refresh_rollups(self, full: bool = False) -> None:
+        self.create_schema()
+        columns = [
+            "ano",
+            "mes",
+            "deputado_id",
+            "nome_deputado",
+            "sigla_partido",
+            "sigla_uf",
+            "tipo_despesa",
+            "fornecedor_id",
+            "total",
+            "quantidade",
+            "linhas",
+            "minimo",
+            "maximo",
+        ]
+
+        start = time.perf_counter()
+        if full or self.rollups_stale:
+            with self.engine.begin() as connection:
+                connection.execute(delete(DespesasAgregadas))
+                connection.execute(insert(DespesasAgregadas).from_select(columns, self._rollup_select()))
+                self._mark_loaded(connection)
+            partitions = "todas as"
+        else:
+            meses_por_ano: dict[int, list[int]] = {}
+            for ano, mes in self.dirty_partitions:
+                meses_por_ano.setdefault(ano, []).append(mes)
+
+            for ano, meses in meses_por_ano.items():
+                with self.engine.begin() as connection:
+                    connection.execute(
+                        delete(DespesasAgregadas).where(DespesasAgregadas.ano == ano, DespesasAgregadas.mes.in_(meses))
+                    )
+                    stmt = self._rollup_select().where(Despesas.ano == ano, Despesas.mes.in_(meses))
+                    connection.execute(insert(DespesasAgregadas).from_select(columns, stmt))
+            if self.dirty_partitions:
+                self.mark_loaded()
+            partitions = len(self.dirty_partitions)
+
+        self.dirty_partitions.clear()
+        self.rollups_stale = False
+        logger.info(
+            f"Agregados recalculados para {partitions} partições (ano, mês) em {time.perf_counter() - start:.2f}s"
+        )
+
+    # Deputados are keyed by id, and two of them can share a name
+    def _drop_nome_unique(self) -> None:
+        constraints = [
+            constraint
+            for constraint in inspect(self.engine).get_unique_constraints(Deputados.__tablename__)
+            if constraint["column_names"] == ["nome"]
+        ]
+        if not constraints:
+            return
+
+        logger.info("Removendo unicidade de deputados.nome")
+        table = Deputados.__table__
+        columns = ", ".join(column.name for column in table.columns)
+        with self.engine.begin() as connection:
+            if self.dialect == "mysql":
+                for constraint in constraints:
+                    name = self.engine.dialect.identifier_preparer.quote(constraint["name"])
+                    connection.exec_driver_sql(f"ALTER TABLE deputados DROP INDEX {name}")
+                return
+
+            # SQLite can't drop a constraint, so the table is rebuilt from the model. The new table is renamed last,
+            # renaming the old one would repoint the foreign key of despesas at it.
+            for index in table.indexes:
+                connection.exec_driver_sql(f"DROP INDEX IF EXISTS {index.name}")
+            table.to_metadata(MetaData(), name="deputados_novos").create(connection)
+            connection.exec_driver_sql(f"INSERT INTO deputados_novos ({columns}) SELECT {columns} FROM deputados")
+            connection.exec_driver_sql("DROP TABLE deputados")
+            connection.exec_driver_sql("ALTER TABLE deputados_novos RENAME TO deputados")
+
+    def _backfill_chaves(self) -> None:
+        while True:
+            with self.engine.begin() as connection:
+                rows = [
+                    dict(row)
+                    for row in connection.execute(
+                        select(Despesas.__table__).where(Despesas.chave.is_(None)).limit(self.chunk_size)
+                    ).mappings()
+                ]
+                if not rows:
+                    return
+
+                chaves = {}
+                for row in rows:
+                    chaves.setdefault(despesa_key(row), []).append(row["id"])
+                existing = set()
+                keys = list(chaves)
+                for offset in range(0, len(keys), LOOKUP_SIZE):
+                    existing.update(
+                        connection.execute(
+                            select(Despesas.chave).where(Despesas.chave.in_(keys[offset : offset + LOOKUP_SIZE]))
+                        ).scalars()
+                    )
+
+                # Rows loaded before despesas had a natural key were never deduplicated, keep one per key
+                duplicates = []
+                updates = []
+                for chave, ids in chaves.items():
+                    if chave in existing:
+                        duplicates.extend(ids)
+                    else:
+                        updates.append({"row_id": ids[0], "chave": chave})
+                        duplicates.extend(ids[1:])
+
+                if duplicates:
+                    connection.execute(delete(Despesas).where(Despesas.id.in_(duplicates)))
+                if updates:
+                    connection.execute(text("UPDATE despesas SET chave = :chave WHERE id = :row_id"), updates)
+                logger.info(f"Chaves preenchidas: {len(updates)}, duplicadas removidas: {len(duplicates)}")
+
+    def migrate(self) -> None:
+        self.create_schema()
+        self._drop_nome_unique()
+
+        logger.info("Preenchendo chaves naturais das despesas")
+        self._backfill_chaves()
+
+        logger.info("Preenchendo deputado_id e fornecedor_id das despesas")
+        with self.engine.begin() as connection:
+            connection.execute(
+                text(
+                    "UPDATE despesas SET deputado_id = "
+                    "(SELECT deputados.id FROM deputados WHERE deputados.nome = despesas.nome_deputado) "
+                    "WHERE deputado_id IS NULL"
+                )
+            )
+            connection.execute(
+                text(
+                    "UPDATE despesas SET fornecedor_id = "
+                    "(SELECT fornecedores.id FROM fornecedores "
+                    "WHERE fornecedores.cnpj_cpf_fornecedor = despesas.cnpj_cpf_fornecedor) "
+                    "WHERE fornecedor_id IS NULL"
+                )
+            )
@@ -0,0 +1,71 @@
+import datetime
+import json
+import threading
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Any
+
+from data_ingestion.services.log_service import logger
+from data_ingestion.utils.decorators import bounded_repr, metrics
+
+DEAD_LETTER_PATH = "dead_letters.jsonl"
+MAX_ITEM_LENGTH = 4096
+
+
+class DeadLetterService:
+    """Items and requests that failed during ingestion, appended to a JSON Lines file so a later run can retry them."""
+
+    def __init__(self, path: str | Path = DEAD_LETTER_PATH) -> None:
+        self.path = Path(path)
+        self.counts: Counter = Counter()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _bounded(value: Any) -> Any:
+        # Raw items are kept as JSON when small enough, anything else is stored as a truncated repr
+        try:
+            text = json.dumps(value, default=str)
+        except (TypeError, ValueError):
+            return bounded_repr(value, MAX_ITEM_LENGTH)
+        return value if len(text) <= MAX_ITEM_LENGTH else bounded_repr(value, MAX_ITEM_LENGTH)
+
+    def add(self, kind: str, error: BaseException | str, **context: Any) -> None:
+        entry = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "error": error if isinstance(error, str) else f"{type(error).__name__}: {bounded_repr(str(error))}",
+            "created_at": datetime.datetime.now(tz=datetime.UTC).isoformat(),
+            **{key: self._bounded(value) for key, value in context.items()},
+        }
+        line = json.dumps(entry, default=str, ensure_ascii=False) + "\n"
+        with self._lock:
+            # One write per line in append mode, so bulk workers can share the file
+            with self.path.open("a", encoding="utf-8") as file:
+                file.write(line)
+            self.counts[kind] += 1
+        metrics.count("dead_letters", rows=1)
+
+    def read(self, kinds: set[str] | None = None) -> list[dict]:
+        if not self.path.exists():
+            return []
+        with self.path.open(encoding="utf-8") as file:
+            entries = [json.loads(line) for line in file if line.strip()]
+        return [entry for entry in entries if kinds is None or entry["kind"] in kinds]
+
+    # Entries added while a retry ran are kept, only the ones it took are dropped
+    def remove(self, entries: list[dict]) -> None:
+        ids = {entry["id"] for entry in entries}
+        with self._lock:
+            remaining = [entry for entry in self.read() if entry["id"] not in ids]
+            tmp_path = self.path.with_suffix(".tmp")
+            tmp_path.write_text(
+                "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in remaining), encoding="utf-8"
+            )
+            tmp_path.replace(self.path)
+        logger.info(f"{len(ids)} dead letters removed, {len(remaining)} left in {self.path}")
+
+    def log_stats(self) -> None:
+        if self.counts:
+            summary = ", ".join(f"{count} {kind}" for kind, count in self.counts.most_common())
+            logger.warning(f"Dead letters written to {self.path}: {summary}")
@@ -0,0 +1,180 @@
+import datetime
+import shutil
+import tempfile
+import threading
+import time
+from collections.abc import Generator, Iterable, Sequence
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+from sqlalchemy import Table
+
+from data_ingestion.services.db_service import (
+    DBService,
+    Deputados,
+    Despesas,
+    DespesasAgregadas,
+    DespesasAnomalias,
+    Fornecedores,
+    UltimaCarga,
+)
+from data_ingestion.services.engine_service import FETCH_SIZE, arrow_frame, fetch_batches
+from data_ingestion.services.log_service import logger
+
+DUCKDB_PATH = "analytics.duckdb"
+DUCKDB_TYPES = {int: "BIGINT", float: "DOUBLE", str: "VARCHAR", datetime.datetime: "TIMESTAMP"}
+
+# Tables rewritten only for the years that changed, and small tables copied whole on every refresh
+YEAR_TABLES: list[Table] = [Despesas.__table__, DespesasAgregadas.__table__]
+FULL_TABLES: list[Table] = [Deputados.__table__, Fornecedores.__table__, UltimaCarga.__table__]
+ANOMALY_TABLE: Table = DespesasAnomalias.__table__
+
+
+@dataclass
+class _Attached:
+    version: tuple[int, int]
+    connection: duckdb.DuckDBPyConnection
+    users: int = 0
+    retired: bool = False
+
+
+_connections: dict[Path, _Attached] = {}
+_connections_lock = threading.Lock()
+
+
+class DuckDBService:
+    """Columnar copy of the database in an embedded DuckDB file, queried in process by the dashboard."""
+
+    def __init__(self, db_service: DBService, path: str | Path = DUCKDB_PATH, chunk_size: int = FETCH_SIZE) -> None:
+        self.db_service = db_service
+        self.path = Path(path)
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def _create_table(connection: duckdb.DuckDBPyConnection, table: Table) -> None:
+        columns = ", ".join(f"{column.name} {DUCKDB_TYPES[column.type.python_type]}" for column in table.columns)
+        connection.execute(f"CREATE TABLE IF NOT EXISTS {table.name} ({columns})")
+
+    # Rows are streamed out of the database as Arrow batches and appended without going through pandas
+    def _copy(self, connection: duckdb.DuckDBPyConnection, table: Table, ano: int | None = None) -> int:
+        where = "" if ano is None else f"WHERE ano = {int(ano)}"
+        connection.execute(f"DELETE FROM {table.name} {where}")
+        query = f"SELECT {', '.join(column.name for column in table.columns)} FROM {table.name} {where}"
+
+        rows = 0
+        for batch in fetch_batches(self.db_service.engine, query, batch_size=self.chunk_size):
+            connection.register("lote", pa.Table.from_batches([batch]))
+            connection.execute(f"INSERT INTO {table.name} SELECT * FROM lote")
+            connection.unregister("lote")
+            rows += batch.num_rows
+        return rows
+
+    # A file written before a column was added to the models cannot take the new rows, so it is rewritten whole
+    def _outdated(self) -> bool:
+        with duckdb.connect(str(self.path), read_only=True) as connection:
+            columns = set(
+                connection.execute("SELECT table_name, column_name FROM information_schema.columns").fetchall()
+            )
+        return any(
+            (table.name, column.name) not in columns
+            for table in [*YEAR_TABLES, *FULL_TABLES, ANOMALY_TABLE]
+            for column in table.columns
+        )
+
+    def _write_file(self, path: Path, anos: list[int] | None, anomalies: bool) -> int:
+        rows = 0
+        with duckdb.connect(str(path)) as connection:
+            for table in [*YEAR_TABLES, *FULL_TABLES, ANOMALY_TABLE]:
+                self._create_table(connection, table)
+            for table in FULL_TABLES:
+                rows += self._copy(connection, table)
+            for table in YEAR_TABLES:
+                if anos is None:
+                    rows += self._copy(connection, table)
+                else:
+                    rows += sum(self._copy(connection, table, ano) for ano in anos)
+            if anos is None or anomalies:
+                rows += self._copy(connection, ANOMALY_TABLE)
+        return rows
+
+    # The refresh works on a copy that is swapped in when complete, so the dashboard never waits on a lock
+    # or reads a half-written year; the copy costs one sequential read of the file.
+    def write(self, anos: Iterable[int] | None = None, anomalies: bool = False) -> None:
+        start = time.perf_counter()
+        self.db_service.create_schema()
+        if not self.path.exists() or self._outdated():
+            anos = None
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            dir=self.path.parent, prefix=f".{self.path.name}-", suffix=".tmp", delete=False
+        ) as tmp_file:
+            tmp_path = Path(tmp_file.name)
+
+        if anos is None:
+            tmp_path.unlink()
+        else:
+            shutil.copyfile(self.path, tmp_path)
+        try:
+            rows = self._write_file(tmp_path, None if anos is None else sorted(anos), anomalies)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+        tmp_path.replace(self.path)
+        logger.info(f"DuckDB: {rows} linhas copiadas em {time.perf_counter() - start:.2f}s para {self.path}")
+
+
+# One connection per version of the file, a refresh swaps in a new file and so gets a new connection. The file is
+# attached to an in-memory database because duckdb.connect would hand back the instance still open on the old file.
+# A replaced connection is closed once its last query is done, which also frees the disk space of the old file.
+@contextmanager
+def open_cursor(path: str | Path) -> Generator[duckdb.DuckDBPyConnection]:
+    path = Path(path).resolve()
+    stat = path.stat()
+    version = (stat.st_ino, stat.st_mtime_ns)
+    with _connections_lock:
+        attached = _connections.get(path)
+        if attached is None or attached.version != version:
+            if attached is not None:
+                _retire(attached)
+            connection = duckdb.connect()
+            try:
+                connection.execute(f"ATTACH '{str(path).replace("'", "''")}' AS analytics (READ_ONLY)")
+            except duckdb.Error:
+                connection.close()
+                raise
+            attached = _connections[path] = _Attached(version, connection)
+        attached.users += 1
+
+    try:
+        # A cursor is a connection of its own to the same database, so concurrent sessions don't share state
+        with attached.connection.cursor() as cursor:
+            cursor.execute("USE analytics")
+            yield cursor
+    finally:
+        with _connections_lock:
+            attached.users -= 1
+            if attached.retired:
+                _retire(attached)
+
+
+def _retire(attached: _Attached) -> None:
+    attached.retired = True
+    if attached.users == 0:
+        attached.connection.close()
+
+
+# Takes the same %s placeholders as the MySQL queries, so the dashboard keeps a single set of queries
+def query_frame(
+    path: str | Path,
+    query: str,
+    params: Sequence | None = None,
+    dtypes: dict[str, str] | None = None,
+) -> pd.DataFrame:
+    with open_cursor(path) as cursor:
+        table = cursor.execute(query.replace("%s", "?"), list(params or ())).to_arrow_table()
+    return arrow_frame(table, dtypes)
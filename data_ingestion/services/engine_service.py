@@ -0,0 +1,131 @@
+import os
+import threading
+from collections.abc import Iterator, Sequence
+from typing import Any
+
+import pandas as pd
+import pyarrow as pa
+from sqlalchemy import Engine, create_engine, event
+
+SQLITE_PATH = "database.db"
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "temp_store": "MEMORY",
+    "cache_size": -64000,
+}
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+POOL_RECYCLE = 3600
+FETCH_SIZE = 100_000
+
+_engines: dict[tuple, Engine] = {}
+_engines_lock = threading.Lock()
+
+
+def set_sqlite_pragmas(dbapi_connection: Any, _: Any) -> None:
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {pragma}={value}")
+    cursor.close()
+
+
+def mysql_url(
+    user: str | None = None,
+    password: str | None = None,
+    host: str | None = None,
+    port: int | None = None,
+    dbname: str | None = None,
+) -> str:
+    return f"mysql+pymysql://{user}:{password}@{host}:{port}/{dbname}"
+
+
+def env_url() -> str:
+    return mysql_url(
+        user=os.environ["DB_USER"],
+        password=os.environ["DB_PASSWORD"],
+        host=os.environ["DB_HOST"],
+        port=int(os.environ["DB_PORT"]),
+        dbname=os.environ["DB_NAME"],
+    )
+
+
+# One pooled engine per url and connection options for the whole process, shared by ingestion and dashboard
+def get_engine(url: str, **connect_args: Any) -> Engine:
+    key = (url, tuple(sorted(connect_args.items())))
+    with _engines_lock:
+        if key in _engines:
+            return _engines[key]
+
+        if url.startswith("sqlite"):
+            engine = create_engine(url, connect_args=connect_args)
+            event.listen(engine, "connect", set_sqlite_pragmas)
+        else:
+            engine = create_engine(
+                url,
+                pool_size=POOL_SIZE,
+                max_overflow=MAX_OVERFLOW,
+                pool_recycle=POOL_RECYCLE,
+                pool_pre_ping=True,
+                connect_args=connect_args,
+            )
+
+        _engines[key] = engine
+        return engine
+
+
+def _arrow_array(values: Sequence) -> pa.Array:
+    array = pa.array(values)
+    # DECIMAL results (SUM, AVG) would otherwise reach pandas as Python Decimal objects
+    if pa.types.is_decimal(array.type):
+        return array.cast(pa.float64())
+    return array
+
+
+# Streams the result through a server-side cursor, FETCH_SIZE rows at a time, as Arrow record batches
+def fetch_batches(
+    engine: Engine, query: str, params: Sequence | None = None, batch_size: int = FETCH_SIZE
+) -> Iterator[pa.RecordBatch]:
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True).exec_driver_sql(query, tuple(params or ()))
+        columns = list(result.keys())
+        empty = True
+        for rows in result.partitions(batch_size):
+            arrays = [_arrow_array(values) for values in zip(*rows, strict=True)]
+            yield pa.record_batch(arrays, names=columns)
+            empty = False
+
+        if empty:
+            yield pa.record_batch([pa.array([], pa.null()) for _ in columns], names=columns)
+
+
+def fetch_table(engine: Engine, query: str, params: Sequence | None = None, batch_size: int = FETCH_SIZE) -> pa.Table:
+    batches = list(fetch_batches(engine, query, params, batch_size))
+    schema = pa.unify_schemas([batch.schema for batch in batches], promote_options="permissive")
+    return pa.Table.from_batches([batch.cast(schema) for batch in batches], schema=schema)
+
+
+def fetch_frame(
+    engine: Engine,
+    query: str,
+    params: Sequence | None = None,
+    dtypes: dict[str, str] | None = None,
+    batch_size: int = FETCH_SIZE,
+) -> pd.DataFrame:
+    return arrow_frame(fetch_table(engine, query, params, batch_size), dtypes)
+
+
+def arrow_frame(table: pa.Table, dtypes: dict[str, str] | None = None) -> pd.DataFrame:
+    # Integer sums come back from DuckDB as 128-bit DECIMAL, which pandas would hold as Decimal objects
+    for index, field in enumerate(table.schema):
+        if pa.types.is_decimal(field.type):
+            table = table.set_column(index, field.name, table.column(index).cast(pa.float64()))
+    dtypes = {column: dtype for column, dtype in (dtypes or {}).items() if column in table.column_names}
+
+    # Categories are built on the Arrow side, so repeated strings never exist as Python objects in the frame
+    for column, dtype in dtypes.items():
+        if dtype == "category":
+            index = table.column_names.index(column)
+            table = table.set_column(index, column, table.column(column).dictionary_encode())
+
+    return table.to_pandas().astype({column: dtype for column, dtype in dtypes.items() if dtype != "category"})
@@ -0,0 +1,182 @@
+import asyncio
+import json
+import random
+import time
+from collections.abc import AsyncIterator
+from types import TracebackType
+from typing import Any, Self
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+
+from data_ingestion.services.cache_service import ResponseCache
+from data_ingestion.services.log_service import logger
+from data_ingestion.utils.decorators import metrics
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+MAX_PAGE_SIZE = 100
+
+
+def get_last_page(response: dict) -> int:
+    for link in response.get("links") or []:
+        if link.get("rel") == "last":
+            pagina = parse_qs(urlparse(link["href"]).query).get("pagina")
+            if pagina:
+                return int(pagina[0])
+    return 1
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int | None = None) -> None:
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AsyncFetcher:
+    def __init__(
+        self,
+        max_concurrency: int = 10,
+        rate_limit: float = 20.0,
+        max_retries: int = 5,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+        timeout: float = 30.0,
+        cache: ResponseCache | None = None,
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.cache = cache
+        self.bucket = TokenBucket(rate=rate_limit)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.client: httpx.AsyncClient | None = None
+        self.request_count = 0
+
+    async def __aenter__(self) -> Self:
+        self.client = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency),
+        )
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def _backoff(self, attempt: int, response: httpx.Response | None = None) -> float:
+        if response is not None and (retry_after := response.headers.get("Retry-After")):
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        delay = min(self.backoff_base * 2**attempt, self.backoff_max)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def get(
+        self,
+        url: str,
+        params: dict[str, Any] | None = None,
+        headers: dict[str, str] | None = None,
+    ) -> httpx.Response:
+        if self.client is None:
+            msg = "AsyncFetcher must be used as an async context manager"
+            raise RuntimeError(msg)
+
+        attempt = 0
+        while True:
+            async with self.semaphore:
+                await self.bucket.acquire()
+                self.request_count += 1
+                try:
+                    response = await self.client.get(url, params=params, headers=headers)
+                except httpx.TransportError as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    delay = self._backoff(attempt)
+                    logger.warning(f"Request to {url} failed ({e!r}), retrying in {delay:.1f}s")
+                else:
+                    metrics.count("http", requests=1, bytes=len(response.content))
+                    if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                        if response.status_code != httpx.codes.NOT_MODIFIED:
+                            response.raise_for_status()
+                        return response
+                    delay = self._backoff(attempt, response)
+                    logger.warning(f"Request to {url} returned {response.status_code}, retrying in {delay:.1f}s")
+
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def get_json(self, url: str, params: dict[str, Any] | None = None) -> Any:
+        if self.cache is None:
+            response = await self.get(url, params=params)
+            return response.json()
+
+        entry = self.cache.get(url, params)
+        if entry is not None and self.cache.is_fresh(entry):
+            self.cache.hit(entry)
+            return json.loads(self.cache.read_bytes(entry))
+
+        response = await self.get(url, params=params, headers=self.cache.validators(entry))
+        if response.status_code == httpx.codes.NOT_MODIFIED and entry is not None:
+            self.cache.hit(entry, revalidated=True)
+            return json.loads(self.cache.read_bytes(entry))
+
+        self.cache.miss()
+        self.cache.store_bytes(url, params, response.content, dict(response.headers))
+        return response.json()
+
+    async def get_pages(
+        self,
+        url: str,
+        params: dict[str, Any] | None = None,
+        page_size: int = MAX_PAGE_SIZE,
+    ) -> AsyncIterator[list]:
+        params = {**(params or {}), "itens": page_size}
+        first = await self.get_json(url, {**params, "pagina": 1})
+        yield first.get("dados")
+
+        tasks = [
+            asyncio.create_task(self.get_json(url, {**params, "pagina": pagina}))
+            for pagina in range(2, get_last_page(first) + 1)
+        ]
+        try:
+            for task in tasks:
+                yield (await task).get("dados")
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def get_all_pages(
+        self,
+        url: str,
+        params: dict[str, Any] | None = None,
+        page_size: int = MAX_PAGE_SIZE,
+    ) -> tuple[list, int]:
+        items = []
+        pages = 0
+        async for page in self.get_pages(url, params, page_size):
+            items.extend(page)
+            pages += 1
+        return items, pages
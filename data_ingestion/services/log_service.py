@@ -2,5 +2,7 @@ import sys
 
 from loguru import logger
 
-logger.add("logs.log", format="{time} {level} {message}", filter="my_module", level="INFO")
-logger.add(sys.stderr, level="INFO")
+# Records are handed to a background thread, so logging from the hot loops never waits on stderr or the file
+logger.remove()
+logger.add("logs.log", format="{time} {level} {message}", filter="my_module", level="INFO", enqueue=True)
+logger.add(sys.stderr, level="INFO", enqueue=True)
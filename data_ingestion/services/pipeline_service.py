@@ -0,0 +1,88 @@
+import queue
+import threading
+import time
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass
+from typing import Any
+
+from data_ingestion.services.log_service import logger
+
+QUEUE_SIZE = 4
+PUT_TIMEOUT = 1.0
+
+_DONE = object()
+
+
+@dataclass
+class _SourceError:
+    name: str
+    error: Exception
+
+
+class PipelineService:
+    """Runs batch sources on threads and hands their batches to a single writer through a bounded queue."""
+
+    def __init__(self, queue_size: int = QUEUE_SIZE) -> None:
+        self.queue_size = queue_size
+
+    # A full queue blocks the source, so fetching never runs more than queue_size batches ahead of the writer.
+    # Returns False once the writer has stopped and the item was dropped.
+    @staticmethod
+    def put(batches: queue.Queue, item: Any, stop: threading.Event | None = None) -> bool:
+        while stop is None or not stop.is_set():
+            try:
+                batches.put(item, timeout=PUT_TIMEOUT)
+            except queue.Full:
+                continue
+            return True
+        return False
+
+    @staticmethod
+    def _produce(name: str, source: Callable[[], Iterable[Any]], batches: queue.Queue, stop: threading.Event) -> None:
+        try:
+            for batch in source():
+                if not PipelineService.put(batches, batch, stop):
+                    return
+        except Exception as e:
+            PipelineService.put(batches, _SourceError(name, e), stop)
+        finally:
+            PipelineService.put(batches, _DONE, stop)
+
+    def run(self, sources: dict[str, Callable[[], Iterable[Any]]], write: Callable[[Any], None]) -> int:
+        batches: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        threads = [
+            threading.Thread(target=self._produce, args=(name, source, batches, stop), name=name, daemon=True)
+            for name, source in sources.items()
+        ]
+        for thread in threads:
+            thread.start()
+
+        start = time.perf_counter()
+        written = 0
+        finished = 0
+        errors = []
+        try:
+            while finished < len(threads):
+                item = batches.get()
+                if item is _DONE:
+                    finished += 1
+                elif isinstance(item, _SourceError):
+                    logger.opt(exception=item.error).error(f"Source {item.name} failed")
+                    errors.append(item.error)
+                else:
+                    write(item)
+                    written += 1
+        finally:
+            # Sources blocked on a full queue give up once the writer stops
+            stop.set()
+
+        for thread in threads:
+            thread.join()
+
+        logger.info(
+            f"Pipeline wrote {written} batches from {len(threads)} sources in {time.perf_counter() - start:.1f}s"
+        )
+        if errors:
+            raise errors[0]
+        return written
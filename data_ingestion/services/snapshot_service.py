@@ -0,0 +1,109 @@
+import shutil
+import tempfile
+import time
+from collections.abc import Iterable
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import Select, select
+
+from data_ingestion.services.db_service import DBService, Deputados, Despesas, Fornecedores
+from data_ingestion.services.log_service import logger
+
+SNAPSHOT_DIR = "snapshot/despesas"
+SNAPSHOT_CHUNK_SIZE = 100_000
+
+# Same columns as the dashboard table plus the row id used for pagination; `ano` is stored in the partition path
+SNAPSHOT_SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("nome_deputado", pa.string()),
+    ("mes", pa.int16()),
+    ("tipo_despesa", pa.string()),
+    ("valor_documento", pa.float64()),
+    ("cnpj_cpf_fornecedor", pa.string()),
+    ("sigla_partido", pa.string()),
+    ("id_legislatura", pa.int32()),
+    ("sigla_uf", pa.string()),
+    ("nome_fornecedor", pa.string()),
+])
+DICTIONARY_COLUMNS = [field.name for field in SNAPSHOT_SCHEMA if pa.types.is_string(field.type)]
+
+
+class SnapshotService:
+    """Parquet copy of the joined expenses view, partitioned by year, read by the dashboard instead of the database."""
+
+    def __init__(
+        self,
+        db_service: DBService,
+        directory: str | Path = SNAPSHOT_DIR,
+        chunk_size: int = SNAPSHOT_CHUNK_SIZE,
+    ) -> None:
+        self.db_service = db_service
+        self.directory = Path(directory)
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def _select(ano: int) -> Select:
+        return (
+            select(
+                Despesas.id,
+                Despesas.nome_deputado,
+                Despesas.mes,
+                Despesas.tipo_despesa,
+                Despesas.valor_documento,
+                Despesas.cnpj_cpf_fornecedor,
+                Deputados.sigla_partido,
+                Deputados.id_legislatura,
+                Deputados.sigla_uf,
+                Fornecedores.nome_fornecedor,
+            )
+            .outerjoin(Deputados, Despesas.deputado_id == Deputados.id)
+            .outerjoin(Fornecedores, Despesas.fornecedor_id == Fornecedores.id)
+            .where(Despesas.ano == ano)
+        )
+
+    def _write_file(self, ano: int, path: Path) -> int:
+        rows = 0
+        with (
+            self.db_service.engine.connect() as connection,
+            pq.ParquetWriter(path, SNAPSHOT_SCHEMA, use_dictionary=DICTIONARY_COLUMNS, compression="zstd") as writer,
+        ):
+            result = connection.execution_options(stream_results=True).execute(self._select(ano))
+            for chunk in result.partitions(self.chunk_size):
+                columns = zip(*chunk, strict=True)
+                arrays = [
+                    pa.array(column, type=field.type) for column, field in zip(columns, SNAPSHOT_SCHEMA, strict=True)
+                ]
+                writer.write_table(pa.Table.from_arrays(arrays, schema=SNAPSHOT_SCHEMA))
+                rows += len(chunk)
+        return rows
+
+    # Each year is written to a temporary file and swapped in, so readers never see a partial partition
+    def _write_year(self, ano: int) -> int:
+        partition = self.directory / f"ano={ano}"
+        partition.mkdir(parents=True, exist_ok=True)
+
+        with tempfile.NamedTemporaryFile(dir=partition, prefix=".part-", suffix=".tmp", delete=False) as tmp_file:
+            tmp_path = Path(tmp_file.name)
+        try:
+            rows = self._write_file(ano, tmp_path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+        if rows == 0:
+            shutil.rmtree(partition)
+        else:
+            tmp_path.replace(partition / "part-0.parquet")
+        return rows
+
+    def write(self, anos: Iterable[int] | None = None) -> None:
+        if anos is None:
+            with self.db_service.engine.connect() as connection:
+                anos = connection.scalars(select(Despesas.ano).distinct().where(Despesas.ano.is_not(None))).all()
+
+        start = time.perf_counter()
+        rows = sum(self._write_year(ano) for ano in sorted(anos))
+        self.db_service.mark_loaded()
+        logger.info(f"Snapshot Parquet: {rows} linhas em {time.perf_counter() - start:.2f}s em {self.directory}")
@@ -1,28 +1,62 @@
+import cProfile
 import inspect
+import io
+import json
+import pstats
+import reprlib
+import resource
 import sys
+import threading
+import time
 import traceback
-from typing import Callable, ParamSpec, TypeVar
+from collections import Counter
+from collections.abc import Generator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from functools import wraps
+from pathlib import Path
+from typing import Any, Callable, ParamSpec, TypeVar
 
 from loguru import logger
 from rich.console import Console
 from rich.traceback import Traceback
 
-logger.add(sys.stderr, format="{time} {level} {message}", filter="my_module", level="INFO")
+logger.add(sys.stderr, format="{time} {level} {message}", filter="my_module", level="INFO", enqueue=True)
 
 P = ParamSpec("P")
 R = TypeVar("R")
 
+MAX_REPR_LENGTH = 500
+
+# Only the first items of containers are rendered, so a failure never serialises a million-row argument
+_repr = reprlib.Repr(maxlevel=3, maxdict=10, maxlist=10, maxtuple=10, maxset=10, maxstring=200, maxother=200)
+
+
+def bounded_repr(value: Any, max_length: int = MAX_REPR_LENGTH) -> str:
+    try:
+        text = _repr.repr(value)
+    except Exception as e:
+        text = f"<{type(value).__name__} repr failed: {e!r}>"
+    return text if len(text) <= max_length else text[: max_length - 3] + "..."
+
+
+def format_arguments(func: Callable[..., Any], args: tuple, kwargs: dict) -> dict[str, str]:
+    try:
+        bound_args = inspect.signature(func).bind(*args, **kwargs)
+    except TypeError:
+        return {"args": bounded_repr(args), "kwargs": bounded_repr(kwargs)}
+    bound_args.apply_defaults()
+    return {k: bounded_repr(v) for k, v in bound_args.arguments.items()}
+
 
 def error_handler(func: Callable[P, R]) -> Callable[P, R | None]:
     def wrapper(*args: P.args, **kwargs: P.kwargs) -> R | None:
         try:
             return func(*args, **kwargs)
         except Exception as e:
-            bound_args = inspect.signature(func).bind(*args, **kwargs)
-            bound_args.apply_defaults()
-            formatted_args = {k: repr(v) for k, v in bound_args.arguments.items()}
+            formatted_args = format_arguments(func, args, kwargs)
 
-            logger.error(f"Error occurred: {e}")
+            logger.error(f"Error occurred: {bounded_repr(e)}")
             logger.error(f"Function: {func.__name__}")
             logger.error(f"Arguments: {formatted_args}")
             logger.error(f"Module: {func.__module__}")
@@ -71,9 +105,7 @@ def error_handler_v2(func: Callable[P, R]) -> Callable[P, R | None]:
             return func(*args, **kwargs)
         except Exception as e:
             # Format arguments
-            bound_args = inspect.signature(func).bind(*args, **kwargs)
-            bound_args.apply_defaults()
-            formatted_args = {k: repr(v) for k, v in bound_args.arguments.items()}
+            formatted_args = format_arguments(func, args, kwargs)
 
             # Log what rich won't cover
             logger.error(f"Function: {func.__name__}")
@@ -81,7 +113,8 @@ def error_handler_v2(func: Callable[P, R]) -> Callable[P, R | None]:
             logger.error("Function execution failed. Returning None due to error.")
 
             # Render rich traceback to string
-            rich_tb = Traceback.from_exception(type(e), e, e.__traceback__, show_locals=True)
+            # Locals are left out, rendering them would repr every batch in scope
+            rich_tb = Traceback.from_exception(type(e), e, e.__traceback__, show_locals=False, max_frames=20)
             rich_console = Console(file=sys.stderr, width=120, record=True)
             rich_console.print(rich_tb)
 
@@ -92,3 +125,162 @@ def error_handler_v2(func: Callable[P, R]) -> Callable[P, R | None]:
             return None
 
     return wrapper
+
+
+PROFILE_DIR = "profiles"
+PROFILE_LINES = 20
+
+
+@dataclass
+class StageStats:
+    calls: int = 0
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    peak_rss_mb: float = 0.0
+    rows: int = 0
+    requests: int = 0
+    bytes: int = 0
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+class Metrics:
+    """Per-stage timings and counters of a run, shared by every thread of the process."""
+
+    def __init__(self) -> None:
+        self.stages: dict[str, StageStats] = {}
+        self.lock = threading.Lock()
+        self.profile_stages: set[str] = set()
+        self.profile_dir = Path(PROFILE_DIR)
+
+    def record(
+        self, name: str, wall_seconds: float = 0.0, cpu_seconds: float = 0.0, calls: int = 1, **counters: int
+    ) -> None:
+        with self.lock:
+            stats = self.stages.setdefault(name, StageStats())
+            stats.calls += calls
+            stats.wall_seconds += wall_seconds
+            stats.cpu_seconds += cpu_seconds
+            stats.peak_rss_mb = max(stats.peak_rss_mb, peak_rss_mb())
+            for counter, value in counters.items():
+                setattr(stats, counter, getattr(stats, counter) + value)
+
+    # Counters only, for events too frequent or too interleaved to be timed one by one, such as HTTP requests
+    def count(self, name: str, **counters: int) -> None:
+        self.record(name, calls=0, **counters)
+
+    # Adds the report of another process, such as a bulk ingestion worker
+    def merge(self, report: dict[str, dict[str, Any]]) -> None:
+        for name, stats in report.items():
+            counters = {key: value for key, value in stats.items() if key in {"rows", "requests", "bytes"}}
+            self.record(name, stats["wall_seconds"], stats["cpu_seconds"], stats["calls"], **counters)
+            with self.lock:
+                self.stages[name].peak_rss_mb = max(self.stages[name].peak_rss_mb, stats["peak_rss_mb"])
+
+    def reset(self) -> None:
+        with self.lock:
+            self.stages.clear()
+
+    def report(self) -> dict[str, dict[str, Any]]:
+        with self.lock:
+            return {name: asdict(stats) for name, stats in self.stages.items()}
+
+    def to_prometheus(self, prefix: str = "ingestion_stage") -> str:
+        lines = []
+        report = self.report()
+        for field in StageStats.__dataclass_fields__:
+            metric = f"{prefix}_{field}"
+            kind = "gauge" if field == "peak_rss_mb" else "counter"
+            lines.append(f"# TYPE {metric} {kind}")
+            lines.extend(f'{metric}{{stage="{name}"}} {stats[field]}' for name, stats in report.items())
+        return "\n".join(lines) + "\n"
+
+    # Prometheus text for .prom files (node_exporter textfile collector), JSON otherwise
+    def write(self, path: str | Path) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.suffix == ".prom":
+            path.write_text(self.to_prometheus(), encoding="utf-8")
+        else:
+            path.write_text(json.dumps(self.report(), indent=2), encoding="utf-8")
+        logger.info(f"Metrics written to {path}")
+
+    def log_summary(self) -> None:
+        for name, stats in sorted(self.report().items(), key=lambda item: -item[1]["wall_seconds"]):
+            rate = stats["rows"] / stats["wall_seconds"] if stats["wall_seconds"] and stats["rows"] else 0
+            logger.info(
+                f"{name}: {stats['calls']} calls, {stats['wall_seconds']:.2f}s wall, {stats['cpu_seconds']:.2f}s cpu, "
+                f"{stats['rows']} rows ({rate:.0f}/s), {stats['requests']} requests, "
+                f"{stats['bytes'] / 1024**2:.1f} MB, {stats['peak_rss_mb']:.0f} MB peak RSS"
+            )
+
+    def save_profile(self, name: str, profiler: cProfile.Profile) -> None:
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        path = self.profile_dir / f"{name}-{time.time_ns()}.prof"
+        profiler.dump_stats(path)
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(PROFILE_LINES)
+        logger.info(f"Profile of {name} saved to {path}\n{output.getvalue()}")
+
+
+metrics = Metrics()
+
+
+# Times a block as one call of a stage; the yielded counter takes rows, requests and bytes
+@contextmanager
+def stage(name: str) -> Generator[Counter]:
+    counters: Counter[str] = Counter()
+    profiler = cProfile.Profile() if name in metrics.profile_stages else None
+    if profiler is not None:
+        try:
+            profiler.enable()
+        except ValueError:
+            # Only one profiler can run at a time, concurrent calls of the stage are timed but not profiled
+            profiler = None
+
+    start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield counters
+    finally:
+        wall_seconds = time.perf_counter() - start
+        cpu_seconds = time.thread_time() - cpu_start
+        if profiler is not None:
+            profiler.disable()
+            metrics.save_profile(name, profiler)
+        metrics.record(name, wall_seconds, cpu_seconds, **counters)
+
+
+def timed(
+    name: str | None = None, rows: Callable[[Any], int] | None = None
+) -> Callable[[Callable[P, R]], Callable[P, R]]:
+    def decorator(func: Callable[P, R]) -> Callable[P, R]:
+        stage_name = name or func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+
+            @wraps(func)
+            async def async_wrapper(*args: P.args, **kwargs: P.kwargs) -> Any:
+                with stage(stage_name) as counters:
+                    result = await func(*args, **kwargs)
+                    if rows is not None:
+                        counters["rows"] += rows(result)
+                    return result
+
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            with stage(stage_name) as counters:
+                result = func(*args, **kwargs)
+                if rows is not None:
+                    counters["rows"] += rows(result)
+                return result
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,48 @@
+import json
+import re
+from collections.abc import Iterator
+from typing import Any, TextIO
+
+CHUNK_SIZE = 1 << 16
+WHITESPACE_AND_COMMAS = re.compile(r"[\s,]*")
+DELIMITERS = frozenset(" \t\r\n,]")
+
+
+# Yields the items of the array stored under `key` one by one, reading `stream` in chunks
+def iter_json_array(stream: TextIO, key: str, chunk_size: int = CHUNK_SIZE) -> Iterator[Any]:
+    decoder = json.JSONDecoder()
+    array_start = re.compile(rf'"{re.escape(key)}"\s*:\s*\[')
+
+    buffer = ""
+    while (match := array_start.search(buffer)) is None:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        buffer = buffer[-len(key) - 64 :] + chunk
+    buffer = buffer[match.end() :]
+    pos = 0
+    eof = False
+
+    while True:
+        pos = WHITESPACE_AND_COMMAS.match(buffer, pos).end()
+        if pos < len(buffer) and buffer[pos] == "]":
+            return
+
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            end = None
+
+        # A number cut by the chunk boundary ("2." of "2.5") decodes "successfully", so an item is only trusted
+        # once the delimiter after it has been read
+        if end is None or (not eof and (end == len(buffer) or buffer[end] not in DELIMITERS)):
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+
+        yield item
+        pos = end
@@ -0,0 +1,106 @@
+import sqlite3
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from data_ingestion.services.db_service import DBService
+from data_ingestion.services.engine_service import SQLITE_PATH
+
+# Schema of the first release, before despesas had a natural key or a num_documento column
+LEGACY_SCHEMA = """
+CREATE TABLE despesas (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    nome_deputado VARCHAR(100),
+    ano INTEGER,
+    mes INTEGER,
+    tipo_despesa VARCHAR(100),
+    data_documento VARCHAR(100),
+    valor_documento FLOAT,
+    cnpj_cpf_fornecedor VARCHAR(100),
+    valor_liquido FLOAT,
+    valor_glosa FLOAT,
+    fonte VARCHAR(100)
+);
+CREATE TABLE fornecedores (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    nome_fornecedor VARCHAR(100),
+    cnpj_cpf_fornecedor VARCHAR(100) UNIQUE,
+    fonte VARCHAR(100)
+);
+CREATE TABLE deputados (
+    id INTEGER PRIMARY KEY,
+    nome VARCHAR(100) UNIQUE,
+    sigla_partido VARCHAR(100),
+    id_legislatura INTEGER,
+    sigla_uf VARCHAR(100)
+);
+"""
+
+
+def despesa(valor: float, num_documento: str | None) -> dict:
+    return {
+        "deputado_id": 1,
+        "nome_deputado": "A",
+        "ano": 2024,
+        "mes": 1,
+        "tipo_despesa": "COMBUSTÍVEIS",
+        "data_documento": "2024-01-10T00:00:00",
+        "num_documento": num_documento,
+        "valor_documento": valor,
+        "cnpj_cpf_fornecedor": "123",
+        "valor_liquido": valor,
+        "valor_glosa": 0.0,
+        "fonte": "api",
+    }
+
+
+@pytest.fixture
+def legacy_db(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> DBService:
+    monkeypatch.chdir(tmp_path)
+    with sqlite3.connect(SQLITE_PATH) as connection:
+        connection.executescript(LEGACY_SCHEMA)
+        connection.execute("INSERT INTO deputados VALUES (1, 'A', 'P', 57, 'SP')")
+        connection.execute(
+            "INSERT INTO fornecedores (nome_fornecedor, cnpj_cpf_fornecedor, fonte) VALUES ('F', '123', 'api')"
+        )
+        for valor in [1.0, 1.0, 2.0]:
+            row = despesa(valor, None)
+            del row["deputado_id"], row["num_documento"]
+            connection.execute(
+                f"INSERT INTO despesas ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})", list(row.values())
+            )
+    return DBService(local=True)
+
+
+def reload(db: DBService, despesas: list[dict]) -> None:
+    db.insert_data(
+        pd.DataFrame([{"id": 1, "nome": "A", "sigla_partido": "P", "id_legislatura": 57, "sigla_uf": "SP"}]),
+        pd.DataFrame(despesas),
+        pd.DataFrame([{"nome_fornecedor": "F", "cnpj_cpf_fornecedor": "123", "fonte": "api"}]),
+    )
+
+
+def rows(db: DBService) -> list[tuple]:
+    with db.engine.connect() as connection:
+        return connection.exec_driver_sql(
+            "SELECT id, valor_documento, num_documento FROM despesas ORDER BY valor_documento, num_documento"
+        ).all()
+
+
+def test_migrate_removes_legacy_duplicates(legacy_db: DBService) -> None:
+    legacy_db.migrate()
+
+    assert rows(legacy_db) == [(1, 1.0, None), (3, 2.0, None)]
+
+
+def test_reload_after_migrate_updates_legacy_rows(legacy_db: DBService) -> None:
+    legacy_db.migrate()
+    despesas = [despesa(1.0, "9"), despesa(1.0, "10"), despesa(2.0, "11")]
+    reload(legacy_db, despesas)
+
+    assert rows(legacy_db) == [(1, 1.0, "10"), (4, 1.0, "9"), (3, 2.0, "11")]
+
+    reload(legacy_db, despesas)
+
+    assert rows(legacy_db) == [(1, 1.0, "10"), (4, 1.0, "9"), (3, 2.0, "11")]